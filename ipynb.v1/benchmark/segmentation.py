@@ -0,0 +1,166 @@
+'''
+segmentation and extraction benchmark on synthetic long-form audio.
+
+python -m benchmark.segmentation --lengths 600 3600 18000 --output bench.json
+python -m benchmark.segmentation --compare old.json new.json
+'''
+import os
+import sys
+import json
+import time
+import copy
+import logging
+import platform
+import tempfile
+import multiprocessing
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+try:
+    import resource
+except ImportError:
+    resource = None
+
+from benchmark.synthetic import synthesize_media, pattern_labels
+
+BENCH_LENGTHS = [600, 3600, 18000]
+
+
+def _peak_rss_children() -> int:
+    if resource is None:
+        return 0
+    return resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * 1024
+
+
+def _timed(stages: dict, name: str, func, *args, **kwargs):
+    start = time.perf_counter()
+    r = func(*args, **kwargs)
+    stages[name] = time.perf_counter() - start
+    return r
+
+
+def bench_media(media: str, length: int, settings: dict) -> dict:
+    '''runs every stage on media; meant to run in a fresh process per media.'''
+    from segment.segment import segment_wrapper, extract_music, \
+        extract_music_reference, extract_mah_stuff, get_segmenter_service, \
+        segmentation_agreement
+    from utils.memory import peak_rss
+    stages = {}
+    segmentation = _timed(
+        stages, 'segment_wrapper', segment_wrapper, media,
+        batch_size=settings['batch_size'],
+        segment_length_thres=settings['max_segment_length'],
+        stream=settings['stream'], workers=settings['workers'],
+        overlap=settings['overlap'])
+    service = get_segmenter_service(settings['batch_size'])
+    stamps = _timed(
+        stages, 'extract_music', extract_music, segmentation)
+    reference = _timed(
+        stages, 'extract_music_reference', extract_music_reference,
+        copy.deepcopy(segmentation))
+    with tempfile.TemporaryDirectory() as outdir:
+        _timed(
+            stages, 'extract_mah_stuff', extract_mah_stuff, media,
+            segmented_stamps=stamps, outdir=outdir, timestamps=[],
+            soundonly=True, save_config=os.path.join(outdir, 'save.yaml'))
+    total = stages['segment_wrapper'] + stages['extract_music'] + \
+        stages['extract_mah_stuff']
+    return {
+        'length': length,
+        'audio_sec_per_wall_sec': length / total,
+        'segment_audio_sec_per_wall_sec': length / stages['segment_wrapper'],
+        'stages': stages,
+        'model_load': service.load_time,
+        'inference': service.inference_time,
+        'runs': len(segmentation),
+        'label_agreement': segmentation_agreement(
+            segmentation, pattern_labels(length)),
+        'clips': len(stamps),
+        'extract_music_matches_reference': stamps == reference,
+        'peak_rss': peak_rss(),
+        'peak_rss_children': _peak_rss_children(),
+    }
+
+
+def run(lengths: list, workdir: str, settings: dict) -> dict:
+    results = []
+    for length in lengths:
+        media = synthesize_media(workdir, length)
+        logging.info(['benchmarking', media])
+        # a fresh process per length keeps peak RSS and model load honest.
+        with ProcessPoolExecutor(
+                max_workers=1,
+                mp_context=multiprocessing.get_context('spawn')) as pool:
+            r = pool.submit(bench_media, media, length, settings).result()
+        logging.info([
+            length, 'seconds:', f"{r['audio_sec_per_wall_sec']:.1f}x realtime",
+            'peak rss', r['peak_rss'] // (1024 * 1024), 'MB'])
+        results.append(r)
+    return {
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        },
+        'settings': settings,
+        'results': results,
+    }
+
+
+def compare(old: dict, new: dict) -> list:
+    '''[(length, old x realtime, new x realtime, speedup), ...]'''
+    old_results = {x['length']: x for x in old['results']}
+    r = []
+    for result in new['results']:
+        if result['length'] not in old_results:
+            continue
+        before = old_results[result['length']]['audio_sec_per_wall_sec']
+        after = result['audio_sec_per_wall_sec']
+        r.append((result['length'], before, after, after / before))
+    return r
+
+
+if __name__ == '__main__':
+    import argparse
+    from segment.segment import BATCH_SIZE, SEGMENT_OVERLAP
+    from utils.memory import SEGMENT_THRES_AUTO
+    parser = argparse.ArgumentParser(description='segmentation benchmark')
+    parser.add_argument(
+        '--lengths', type=int, nargs='+', default=BENCH_LENGTHS,
+        help='synthetic stream lengths in seconds')
+    parser.add_argument(
+        '--workdir', type=str,
+        default=os.path.join(tempfile.gettempdir(), 'inaseg_bench'),
+        help='where synthetic media is generated and kept between runs')
+    parser.add_argument(
+        '--output', type=str, default='',
+        help='json file to save results to')
+    parser.add_argument(
+        '--compare', type=str, nargs=2, default=None,
+        help='compare two saved json results instead of running')
+    parser.add_argument('--batch_size', type=int, default=BATCH_SIZE)
+    parser.add_argument(
+        '--max_segment_length', type=int, default=SEGMENT_THRES_AUTO)
+    parser.add_argument('--overlap', type=int, default=SEGMENT_OVERLAP)
+    parser.add_argument('--workers', type=int, default=1)
+    parser.add_argument('--stream', action='store_true', default=False)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    if args.compare is not None:
+        old, new = [json.load(open(x, encoding='utf-8')) for x in args.compare]
+        for length, before, after, speedup in compare(old, new):
+            print(f'{length:>7}s: {before:8.1f}x -> {after:8.1f}x realtime ({speedup:.2f}x)')
+        sys.exit(0)
+    report = run(args.lengths, args.workdir, {
+        'batch_size': args.batch_size,
+        'max_segment_length': args.max_segment_length,
+        'overlap': args.overlap,
+        'workers': args.workers,
+        'stream': args.stream,
+    })
+    output = args.output or os.path.join(
+        args.workdir,
+        f"bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    logging.info(['benchmark results saved to', output])
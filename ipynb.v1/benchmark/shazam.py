@@ -0,0 +1,234 @@
+'''
+recognition throughput benchmark against a local fake recognizer.
+
+python -m benchmark.shazam --clips 60 --concurrency 1 2 4 8 --rps 0 1 5
+python -m benchmark.shazam --server_rps 3 --error_rate 0.05 --output bench.json
+'''
+import os
+import json
+import time
+import random
+import asyncio
+import hashlib
+import logging
+import platform
+import tempfile
+from datetime import datetime
+
+from benchmark.synthetic import synthesize_media
+
+BENCH_CLIPS = 60
+BENCH_CONCURRENCY = [1, 2, 4, 8]
+BENCH_RPS = [0, 1, 5]
+
+
+class FakeRateLimitError(Exception):
+    status = 429
+
+    def __str__(self):
+        return '429 Too Many Requests'
+
+
+class FakeRecognizer():
+    '''
+    stands in for shazamio.Shazam: answers after latency (+- jitter) seconds,
+    fails error_rate of the requests, and past server_rps requests per second
+    answers 429 (raised, or as a retryms payload when retryms is set).
+    '''
+
+    def __init__(
+        self,
+        latency: float = 0.3,
+        jitter: float = 0.1,
+        error_rate: float = 0.,
+        server_rps: float = 0,
+        retryms: int = None,
+        seed: int = 0,
+    ):
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.server_rps = server_rps
+        self.retryms = retryms
+        self.random = random.Random(seed)
+        self.requests = 0
+        self.rate_limited = 0
+        self.errors = 0
+        self.in_flight = 0
+        self.max_in_flight = 0
+        self._window = []
+
+    def _over_limit(self) -> bool:
+        if not self.server_rps:
+            return False
+        now = time.monotonic()
+        self._window = [x for x in self._window if now - x < 1]
+        if len(self._window) >= self.server_rps:
+            return True
+        self._window.append(now)
+        return False
+
+    async def recognize(self, data):
+        self.requests += 1
+        self.in_flight += 1
+        self.max_in_flight = max(self.max_in_flight, self.in_flight)
+        try:
+            limited = self._over_limit()
+            await asyncio.sleep(max(0., self.latency + self.random.uniform(
+                -self.jitter, self.jitter)))
+            if limited:
+                self.rate_limited += 1
+                if self.retryms is not None:
+                    return {'retryms': self.retryms}
+                raise FakeRateLimitError()
+            if self.random.random() < self.error_rate:
+                self.errors += 1
+                raise RuntimeError('fake recognizer failure')
+            key = hashlib.sha1(
+                data if isinstance(data, bytes) else str(data).encode()
+            ).hexdigest()[:8]
+            return {
+                'matches': [{'timeskew': 0., 'frequencyskew': 0.}],
+                'track': {
+                    'key': key, 'title': f'title {key}', 'subtitle': 'artist',
+                    'images': {}},
+            }
+        finally:
+            self.in_flight -= 1
+
+    async def send_recognize_request(self, signature):
+        return await self.recognize(repr(signature).encode())
+
+
+def _percentile(values: list, q: float) -> float:
+    if len(values) == 0:
+        return 0.
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def bench_setting(
+        clipdir: str, clips: int, concurrency: int, rps: float,
+        recognizer: FakeRecognizer) -> dict:
+    from segment import shazam
+    from segment.shazam import shazam_threaded, shazam_title, recognize, \
+        configure_shazam, set_recognizer
+    outdir = tempfile.mkdtemp(dir=clipdir)
+    media = os.path.join(clipdir, 'bench.mp3')
+    files = []
+    for i in range(clips):
+        # shazam_threaded renames its clips, so every setting gets fresh links
+        files.append(os.path.join(outdir, f'bench_{str(i).zfill(2)}.mp3'))
+        os.link(media, files[-1])
+    set_recognizer(recognizer)
+    configure_shazam(concurrency=concurrency, rps=rps)
+    backoffs = shazam.limiter.backoffs
+    latencies, failures = [], []
+
+    async def timed(file, **kwargs):
+        start = time.perf_counter()
+        try:
+            match = await recognize(file)
+            return shazam_title(match['track']), match['track']
+        except Exception:
+            failures.append(file)
+            raise
+        finally:
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*[shazam_threaded(
+        file, shazam_func=timed, ignore_fails=True) for file in files])
+    elapsed = time.perf_counter() - start
+    set_recognizer(None)
+    return {
+        'concurrency': concurrency,
+        'rps': rps,
+        'clips': clips,
+        'elapsed': elapsed,
+        'clips_per_sec': clips / elapsed,
+        'latency_p50': _percentile(latencies, 0.5),
+        'latency_p95': _percentile(latencies, 0.95),
+        'latency_p99': _percentile(latencies, 0.99),
+        'latency_max': max(latencies + [0.]),
+        'retries': shazam.limiter.backoffs - backoffs,
+        'failures': len(failures),
+        'requests': recognizer.requests,
+        'rate_limited': recognizer.rate_limited,
+        'max_in_flight': recognizer.max_in_flight,
+    }
+
+
+def run(clips: int, concurrencies: list, rpss: list, workdir: str,
+        recognizer_settings: dict) -> dict:
+    os.makedirs(workdir, exist_ok=True)
+    clipdir = tempfile.mkdtemp(dir=workdir)
+    # every clip is a link to one short synthetic media; the fake never decodes
+    os.replace(synthesize_media(clipdir, 15), os.path.join(clipdir, 'bench.mp3'))
+    results = []
+    for rps in rpss:
+        for concurrency in concurrencies:
+            r = asyncio.run(bench_setting(
+                clipdir, clips, concurrency, rps,
+                FakeRecognizer(**recognizer_settings)))
+            logging.info([
+                'concurrency', concurrency, 'rps', rps, ':',
+                f"{r['clips_per_sec']:.2f} clips/s",
+                f"p95 {r['latency_p95']:.2f}s", 'retries', r['retries'],
+                'failures', r['failures']])
+            results.append(r)
+    return {
+        'date': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        'host': {
+            'platform': platform.platform(),
+            'python': platform.python_version(),
+            'cpu_count': os.cpu_count(),
+        },
+        'recognizer': recognizer_settings,
+        'results': results,
+    }
+
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description='shazam throughput benchmark')
+    parser.add_argument('--clips', type=int, default=BENCH_CLIPS)
+    parser.add_argument(
+        '--concurrency', type=int, nargs='+', default=BENCH_CONCURRENCY)
+    parser.add_argument(
+        '--rps', type=float, nargs='+', default=BENCH_RPS,
+        help='client side requests per second limits; 0 for none')
+    parser.add_argument('--latency', type=float, default=0.3)
+    parser.add_argument('--jitter', type=float, default=0.1)
+    parser.add_argument('--error_rate', type=float, default=0.)
+    parser.add_argument(
+        '--server_rps', type=float, default=0,
+        help='the fake answers 429 past this many requests per second')
+    parser.add_argument(
+        '--retryms', type=int, default=None,
+        help='answer rate limited requests with this retryms instead of a 429')
+    parser.add_argument(
+        '--workdir', type=str,
+        default=os.path.join(tempfile.gettempdir(), 'shazam_bench'))
+    parser.add_argument('--output', type=str, default='')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    report = run(args.clips, args.concurrency, args.rps, args.workdir, {
+        'latency': args.latency,
+        'jitter': args.jitter,
+        'error_rate': args.error_rate,
+        'server_rps': args.server_rps,
+        'retryms': args.retryms,
+    })
+    for r in report['results']:
+        print(
+            f"concurrency {r['concurrency']:>2} rps {r['rps']:>4}: "
+            f"{r['clips_per_sec']:6.2f} clips/s  p50 {r['latency_p50']:.2f}s  "
+            f"p95 {r['latency_p95']:.2f}s  p99 {r['latency_p99']:.2f}s  "
+            f"retries {r['retries']}  failures {r['failures']}")
+    output = args.output or os.path.join(
+        args.workdir,
+        f"shazam_bench_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    logging.info(['benchmark results saved to', output])
@@ -0,0 +1,97 @@
+import os
+import logging
+import subprocess
+
+# 合成测试音频的采样率
+SYNTH_SAMPLE_RATE = 44100
+# 一个循环周期内的各段：(类型, 秒)；按周期重复到目标时长
+SYNTH_PATTERN = [
+    ('music', 240),
+    ('speech', 120),
+    ('tone', 30),
+    ('noise', 60),
+    ('silence', 90),
+    ('music', 180),
+    ('speech', 60),
+]
+# 各段期望的 inaSpeechSegmenter 标签
+SYNTH_LABELS = {
+    'music': 'music',
+    'speech': 'speech',
+    'tone': 'music',
+    'noise': 'noise',
+    'silence': 'noEnergy',
+}
+
+
+def _source(kind: str, duration: int, seed: int) -> str:
+    '''lavfi source for one section of synthetic audio.'''
+    if kind == 'music':
+        # a chord with a slow beat, loud enough to read as music
+        return (
+            "aevalsrc='(0.3*sin(2*PI*220*t)+0.2*sin(2*PI*277.18*t)"
+            "+0.2*sin(2*PI*329.63*t)+0.15*sin(2*PI*440*t))"
+            f"*(0.6+0.4*sin(2*PI*2*t))':s={SYNTH_SAMPLE_RATE}:d={duration}")
+    if kind == 'speech':
+        # band limited noise chopped at a syllable-like rate
+        return (
+            f'anoisesrc=color=pink:amplitude=0.6:seed={seed}'
+            f':r={SYNTH_SAMPLE_RATE}:d={duration},'
+            'bandpass=f=1200:width_type=h:w=2000,tremolo=f=4:d=0.9')
+    if kind == 'tone':
+        return f'sine=frequency=440:sample_rate={SYNTH_SAMPLE_RATE}:d={duration}'
+    if kind == 'noise':
+        return (
+            f'anoisesrc=color=white:amplitude=0.2:seed={seed}'
+            f':r={SYNTH_SAMPLE_RATE}:d={duration}')
+    if kind == 'silence':
+        return f'aevalsrc=0:s={SYNTH_SAMPLE_RATE}:d={duration}'
+    raise ValueError(f'unknown synthetic section {kind}')
+
+
+def synthesize_pattern(path: str, pattern: list = SYNTH_PATTERN, seed: int = 0) -> str:
+    '''renders one cycle of pattern into a mono wav at path.'''
+    cmd = ['ffmpeg', '-v', 'error', '-y']
+    for i, (kind, duration) in enumerate(pattern):
+        cmd += ['-f', 'lavfi', '-i', _source(kind, duration, seed + i)]
+    graph = ''.join(
+        f'[{i}:a]aformat=sample_rates={SYNTH_SAMPLE_RATE}:channel_layouts=mono[a{i}];'
+        for i in range(len(pattern)))
+    graph += ''.join(f'[a{i}]' for i in range(len(pattern)))
+    graph += f'concat=n={len(pattern)}:v=0:a=1[out]'
+    cmd += ['-filter_complex', graph, '-map', '[out]', path]
+    subprocess.run(cmd, check=True)
+    return path
+
+
+def synthesize_media(
+        outdir: str, length: int, pattern: list = SYNTH_PATTERN,
+        seed: int = 0, ext: str = '.mp3') -> str:
+    '''
+    long-form synthetic media of length seconds in outdir, made by looping
+    one rendered pattern cycle; reused if it already exists.
+    '''
+    os.makedirs(outdir, exist_ok=True)
+    media = os.path.join(outdir, f'[synthetic] bench {length}s.{seed}{ext}')
+    if os.path.isfile(media):
+        return media
+    cycle = synthesize_pattern(
+        os.path.join(outdir, f'synthetic_cycle.{seed}.wav'), pattern, seed)
+    logging.info(['synthesizing', length, 'seconds into', media])
+    subprocess.run([
+        'ffmpeg', '-v', 'error', '-y',
+        '-stream_loop', '-1', '-i', cycle,
+        '-t', str(length), '-b:a', '128k', media], check=True)
+    return media
+
+
+def pattern_labels(length: int, pattern: list = SYNTH_PATTERN) -> list:
+    '''the expected (label, start, stop) segmentation of synthesize_media(length).'''
+    r, t = [], 0
+    while t < length:
+        for kind, duration in pattern:
+            if t >= length:
+                break
+            r.append((SYNTH_LABELS[kind], t, min(t + duration, length)))
+            t += duration
+    return r
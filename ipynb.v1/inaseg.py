@@ -5,16 +5,90 @@ import logging
 import tempfile
 import asyncio
 
-from segment.shazam import shazaming
+from segment.shazam import shazaming, shazam_pipeline, shazam_orig, \
+    shazam_sampled, configure_shazam, shutdown_shazam, SHAZAM_RPS, \
+    SHAZAM_CONCURRENCY
+from segment.shazamcache import ShazamCache
+from segment.fingerprint import FingerprintIndex
 from network.download import ytbdl
-from segment.segment import extract_mah_stuff, extract_music, segment_wrapper,\
-    SEGMENT_THRES, TimestampMismatch
+from segment.cache import SegmentCache, SEGMENT_CACHE_DIR, SEGMENT_CACHE_SIZE
+from utils.keyframes import CUT_MODES
+from utils.memory import SEGMENT_THRES_AUTO
+from utils.ffmpeg import extract_audio, media_info, split_into
+from utils.metrics import stage, log_media_metrics
+from utils.timestamp import sec2timestamp
+
+
+def is_segmented(media: str, outdir: str) -> bool:
+    return len(glob.glob(os.path.join(
+        outdir,
+        f'*{os.path.splitext(os.path.basename(media))[0][1:]}_*'))) > 0
+
+
+def segment_media(
+        media: str, args, segmentation: list = None, on_clip=None) -> None:
+    if not is_segmented(media, args.outdir):
+        # imported here, not at the top: the spawned shazam signature workers
+        # re-import this module and must not load tensorflow each.
+        import tensorflow as tf
+        from segment.segment import extract_mah_stuff, extract_music, \
+            segment_wrapper, TimestampMismatch
+        gpus = tf.config.experimental.list_physical_devices('GPU')
+        logging.info(gpus)
+        tf.get_logger().setLevel(logging.WARNING)
+        source = media
+        if args.soundonly != '' and args.audio_intermediate and \
+                media_info(media).has_video:
+            source = extract_audio(media) or media
+        try:
+            timestamps = []
+            if segmentation is None:
+                with stage('segment', media, media_info(source).duration):
+                    segmentation = segment_wrapper(
+                        source, segment_length_thres=args.max_segment_length,
+                        batch_size=128, release_policy=args.segmenter_release,
+                        stream=args.segment_stream, workers=args.segment_workers,
+                        overlap=args.segment_overlap,
+                        prescan=args.energy_prescan,
+                        cache_media=media,
+                        cache=SegmentCache(
+                            args.segment_cache, args.segment_cache_size
+                        ) if args.segment_cache else None)
+            saved_timestamp = extract_music(
+                segmentation, segment_connect=args.seg_connect)
+            extract_mah_stuff(
+                media, segmented_stamps=saved_timestamp,
+                outdir=args.outdir, rev=False,
+                timestamps=timestamps,
+                soundonly=(args.soundonly != ''),
+                max_workers=args.ffmpeg_workers,
+                single_pass=args.single_pass_cut,
+                cut_mode=args.cut_mode,
+                source=source,
+                on_clip=on_clip)
+            saved_timestamp = None
+        except TimestampMismatch:
+            raise
+        finally:
+            if source != media and os.path.isfile(source):
+                os.remove(source)
+            log_media_metrics(source)
+            log_media_metrics(media)
+    else:
+        logging.warning((
+            'segmentation', media, 'stopped to prevent posssible duplication'))
+    logging.info(['segmentation', media, 'successful'])
+    if args.cleanup and os.path.isfile(media):
+        os.remove(media)
 
 
 if __name__ == '__main__':
     import argparse
+    from segment.segment import SEGMENT_OVERLAP, SEGMENTER_RELEASE_POLICY, \
+        RELEASE_POLICIES
     parser = argparse.ArgumentParser(description='ina music segment')
-    parser.add_argument('--media', type=str, help='file path or weblink')
+    parser.add_argument(
+        '--media', type=str, nargs='+', help='file paths or weblinks')
     parser.add_argument(
         '--outdir', type=str, default=tempfile.gettempdir(),
         help='directory media will be downloaded into (if url) and extracted into;\
@@ -29,8 +103,29 @@ if __name__ == '__main__':
         '--aria', type=int, default=None,
         help='use aria, specifying the number of threads')
     parser.add_argument(
-        '--shazam_multithread', type=int, default=1,
-        help='use multithreaded shazam')
+        '--shazam_multithread', type=int, default=SHAZAM_CONCURRENCY,
+        help='shazam requests in flight, and processes building signatures')
+    parser.add_argument(
+        '--shazam_rps', type=float, default=SHAZAM_RPS,
+        help='shazam requests per second; 0 for no limit.')
+    parser.add_argument(
+        '--shazam_sampled', action='store_true', default=False,
+        help='recognize a few short windows from inside each clip instead of \
+            uploading the whole clip.')
+    parser.add_argument(
+        '--fingerprint_index', action='store_true', default=False,
+        help='match clips against a local fingerprint index of songs shazam \
+            already identified before asking shazam; remote matches are \
+            added to it.')
+    parser.add_argument(
+        '--pipeline', action='store_true', default=False,
+        help='with --shazam, recognize each clip as soon as it is cut \
+            instead of after every clip of the media is cut.')
+    parser.add_argument(
+        '--no_shazam_cache', dest='shazam_cache', action='store_false',
+        default=True,
+        help='always ask shazam instead of reusing results cached by the \
+            clip audio.')
     parser.add_argument(
         '--soundonly', type=str, default=r'-f bestaudio',
         help='specify an empty string to extract both video and audio')
@@ -44,10 +139,72 @@ if __name__ == '__main__':
     parser.add_argument(
         '--max_segment_length',
         type=int,
-        default=SEGMENT_THRES,
+        default=SEGMENT_THRES_AUTO,
         help='for computers with limited RAM (eg a 5 hrs stream \
             requires ~6GB VRAM), set this to process streams in \
-                this speficied segments to avoid ram overflow. in seconds.')
+                this speficied segments to avoid ram overflow. in seconds. \
+                    the default (-1) picks the length from available memory.')
+    parser.add_argument(
+        '--segmenter_release', type=str, default=SEGMENTER_RELEASE_POLICY,
+        choices=RELEASE_POLICIES,
+        help='when to release the loaded segmenter model: process keeps it \
+            loaded, media releases it after each media, chunk reloads it for \
+                every segment (lowest RAM, slowest).')
+    parser.add_argument(
+        '--segment_stream', action='store_true', default=False,
+        help='decode the media once through an ffmpeg PCM pipe and segment it \
+            in windows of --max_segment_length seconds, instead of seeking \
+                into the media once per segment.')
+    parser.add_argument(
+        '--segment_workers', type=int, default=1,
+        help='segment the --max_segment_length chunks on this many worker \
+            processes, each loading its own model (needs RAM for each).')
+    parser.add_argument(
+        '--segment_overlap', type=int, default=SEGMENT_OVERLAP,
+        help='seconds of extra audio segmented on both sides of every \
+            --max_segment_length chunk; results are stitched back so songs \
+                crossing a chunk boundary are not split.')
+    parser.add_argument(
+        '--segment_cache', type=str, default=SEGMENT_CACHE_DIR,
+        help='directory caching raw segmentation results, so reruns on the \
+            same media only redo extraction; an empty string disables it.')
+    parser.add_argument(
+        '--segment_cache_size', type=int, default=SEGMENT_CACHE_SIZE,
+        help='segmentation cache size limit in MB; least recently used \
+            results are evicted first.')
+    parser.add_argument(
+        '--ffmpeg_workers', type=int, default=None,
+        help='max ffmpeg processes cutting clips at once; defaults to the \
+            number of cores.')
+    parser.add_argument(
+        '--single_pass_cut', action='store_true', default=False,
+        help='decode the media once and write every clip from that pass \
+            (falls back to one ffmpeg per clip on failure).')
+    parser.add_argument(
+        '--cut_mode', type=str, default='copy', choices=CUT_MODES,
+        help='how video clips are stream copied: copy starts at the previous \
+            keyframe, snap moves the start to the nearest keyframe, which \
+            may be after the requested start: neither is frame accurate.')
+    parser.add_argument(
+        '--no_audio_intermediate', dest='audio_intermediate',
+        action='store_false', default=True,
+        help='in sound only runs, read video sources directly instead of \
+            extracting their audio once into a scratch file first.')
+    parser.add_argument(
+        '--split_length', type=int, default=0,
+        help='stream copy media longer than this many seconds into parts \
+            (in parallel) and process them part by part; 0 to disable. the \
+            original is only removed with --cleanup.')
+    parser.add_argument(
+        '--energy_prescan', action='store_true', default=False,
+        help='skip long silent stretches (AFK, muted) with a cheap energy \
+            pass before running the segmenter on the rest.')
+    parser.add_argument(
+        '--segment_batch', action='store_true', default=False,
+        help='with several --media, decode them together and pack their \
+            windows into shared inference batches (better for many short parts). \
+            windows are --max_segment_length seconds when set; the originals \
+            are decoded directly, without an audio intermediate.')
     logging.basicConfig(
         level=logging.DEBUG,
         format='%(asctime)s %(levelname)-8s %(message)s',
@@ -56,48 +213,61 @@ if __name__ == '__main__':
             logging.StreamHandler()
         ])
     args = parser.parse_args()
-    # media = ytbdl('')
-    if args.media is not None:
-        media = args.media
-    else:
-        media = 'https://www.bilibili.com/video/BV16S411w7dY/?spm_id_from=333.999.0.0'
+    if args.media is None:
         raise Exception('no media')
-    if 'https:' in media:
-        media = ytbdl(
-            media, soundonly=args.soundonly,
-            aria=args.aria, outdir=args.outdir)
-    if len(glob.glob(os.path.join(
-            args.outdir,
-            f'*{os.path.splitext(os.path.basename(media))[0][1:]}_*'))) == 0:
-        import tensorflow as tf
-        gpus = tf.config.experimental.list_physical_devices('GPU')
-        logging.info(gpus)
-        tf.get_logger().setLevel(logging.WARNING)
-        try:
-            timestamps = []
-            saved_timestamp = extract_music(segment_wrapper(
-                media, segment_length_thres=args.max_segment_length, batch_size=128),
-                segment_connect=args.seg_connect)
-            extract_mah_stuff(
-                media, segmented_stamps=saved_timestamp,
-                outdir=args.outdir, rev=False,
-                timestamps=timestamps,
-                soundonly=(args.soundonly != ''))
-            saved_timestamp = None
-        except TimestampMismatch:
-            raise
-    else:
-        logging.warning((
-            'segmentation', media, 'stopped to prevent posssible duplication'))
-    logging.info(['segmentation', media, 'successful'])
-    if args.cleanup and os.path.isfile(media):
-        os.remove(media)
-    if args.shazam:
-        async def myshazam():
-            await shazaming(
-                args.outdir, media, args.shazam_coverart,)
-        loop = asyncio.get_event_loop()
-        loop.run_until_complete(myshazam())
-        loop.close()
+    if args.segment_batch and args.energy_prescan:
+        parser.error('--energy_prescan does not apply to --segment_batch.')
+    medias = [ytbdl(
+        media, soundonly=args.soundonly,
+        aria=args.aria, outdir=args.outdir) if 'https:' in media else media
+        for media in args.media]
+    if args.split_length:
+        parts = []
+        for media in medias:
+            split = None
+            if media_info(media).duration > args.split_length:
+                split = split_into(
+                    media, max_length=args.split_length,
+                    max_workers=args.ffmpeg_workers, remove=args.cleanup)
+            for part, offset in split or []:
+                # clip timestamps are relative to their part
+                logging.info([part, 'starts at', sec2timestamp(offset), 'of', media])
+            parts += [x for x, _ in split] if split else [media]
+        medias = parts
+    segmentations = {}
+    unsegmented = [x for x in medias if not is_segmented(x, args.outdir)]
+    if args.segment_batch and len(unsegmented) > 1:
+        from segment.batching import segment_batch, BATCH_WINDOW
+        segmentations = segment_batch(
+            unsegmented, batch_size=128, overlap=args.segment_overlap,
+            cache=SegmentCache(args.segment_cache, args.segment_cache_size)
+            if args.segment_cache else None,
+            window_sec=args.max_segment_length
+            if args.max_segment_length > 0 else BATCH_WINDOW)
+    configure_shazam(concurrency=args.shazam_multithread, rps=args.shazam_rps)
+    shazam_cache = ShazamCache() if args.shazam and args.shazam_cache else None
+    fingerprint_index = FingerprintIndex() \
+        if args.shazam and args.fingerprint_index else None
+    loop = asyncio.new_event_loop()
+    shazam_func = shazam_sampled if args.shazam_sampled else shazam_orig
+    for media in medias:
+        if args.shazam and args.pipeline and media in unsegmented:
+            loop.run_until_complete(shazam_pipeline(
+                args.outdir, media,
+                lambda on_clip: segment_media(
+                    media, args, segmentations.get(media), on_clip),
+                args.shazam_coverart, shazam_func=shazam_func,
+                cache=shazam_cache, index=fingerprint_index))
+            continue
+        segment_media(media, args, segmentations.get(media))
+        if args.shazam:
+            async def myshazam():
+                await shazaming(
+                    args.outdir, media, args.shazam_coverart,
+                    shazam_func=shazam_func,
+                    cache=shazam_cache, index=fingerprint_index)
+            loop.run_until_complete(myshazam())
+    loop.close()
+    shutdown_shazam()
     import sys
     sys.exit(0)
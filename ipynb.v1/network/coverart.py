@@ -0,0 +1,91 @@
+import os
+import shutil
+import asyncio
+import hashlib
+import logging
+import aiohttp
+
+from network.constants import DEFAULT_UI
+from utils.paths import CACHE_DIR
+
+
+COVERART_CACHE_DIR = os.path.join(CACHE_DIR, 'coverart')
+# 封面下载共用连接池的连接数上限
+COVERART_CONNECTIONS = 8
+COVERART_TIMEOUT = 30
+
+
+def _link_or_copy(src: str, dst: str) -> None:
+    try:
+        if os.path.exists(dst):
+            os.remove(dst)
+        os.link(src, dst)
+    except OSError:
+        # other filesystem, or links not allowed
+        shutil.copyfile(src, dst)
+
+
+class CoverArtFetcher():
+    '''
+    downloads cover art over one pooled aiohttp session. images are cached on
+    disk by the sha1 of their url, concurrent requests for the same url share
+    one download, and repeats are hardlinked (or copied) to their target.
+    '''
+
+    def __init__(
+        self,
+        cache_dir: str = COVERART_CACHE_DIR,
+        connections: int = COVERART_CONNECTIONS,
+    ):
+        self.cache_dir = cache_dir
+        self.connections = connections
+        self.session = None
+        self.inflight = {}
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def path(self, url: str) -> str:
+        ext = os.path.splitext(url.split('?')[0])[1] or '.jpg'
+        return os.path.join(
+            self.cache_dir, hashlib.sha1(url.encode()).hexdigest() + ext)
+
+    async def fetch(self, url: str) -> str:
+        '''the cached file of url, downloading it once.'''
+        path = self.path(url)
+        if os.path.isfile(path):
+            return path
+        if url not in self.inflight:
+            self.inflight[url] = asyncio.ensure_future(self._download(url, path))
+        try:
+            return await asyncio.shield(self.inflight[url])
+        finally:
+            if self.inflight.get(url) is not None and self.inflight[url].done():
+                del self.inflight[url]
+
+    async def _download(self, url: str, path: str) -> str:
+        if self.session is None or self.session.closed:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=COVERART_TIMEOUT),
+                headers={'user-agent': DEFAULT_UI['user-agent']})
+        async with self.session.get(url) as response:
+            response.raise_for_status()
+            content = await response.read()
+        temp_path = f'{path}.{os.getpid()}.tmp'
+
+        def write():
+            with open(temp_path, 'wb') as f:
+                f.write(content)
+            os.replace(temp_path, path)
+        await asyncio.to_thread(write)
+        logging.debug(['downloaded cover art', url, len(content), 'bytes'])
+        return path
+
+    async def save(self, url: str, dst: str) -> str:
+        path = await self.fetch(url)
+        await asyncio.to_thread(_link_or_copy, path, dst)
+        return dst
+
+    async def close(self) -> None:
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
@@ -1,4 +1,4 @@
-from subprocess import Popen, PIPE, check_output
+from subprocess import Popen, PIPE, CalledProcessError
 import os
 import glob
 import logging
@@ -6,6 +6,8 @@ import tempfile
 import time
 import uuid
 
+from utils.ffmpeg import ffmpeg_progress
+
 
 COOKIES_LOCATION = ['--cookies', 'ytdlp_cookies.txt']
 
@@ -62,7 +64,9 @@ def ytbdl(
             'ffmpeg',
             '-f', 'concat', '-safe', '0', '-i',
             os.path.join(outdir, 'merge.txt'), '-c', 'copy', '-y', merged_path]
-        check_output(ffmpeg_merge_cmd)
+        metrics = ffmpeg_progress(ffmpeg_merge_cmd, 'merge', merged_path)
+        if metrics.returncode != 0:
+            raise CalledProcessError(metrics.returncode, ffmpeg_merge_cmd)
         for i in downloaded_files:
             os.remove(i)
         return merged_path
@@ -0,0 +1,111 @@
+import time
+import random
+import asyncio
+import logging
+
+# 被限流后的退避：base * 2^attempt 秒，加随机抖动，最多 max 秒
+BACKOFF_BASE = 2.
+BACKOFF_MAX = 60.
+
+
+def is_rate_limited(e: BaseException) -> bool:
+    '''
+    whether e, or an exception it was raised from, looks like an HTTP 429 /
+    rate limit error. shazamio does not raise on status: a 429 surfaces as
+    FailedDecodeJson from the aiohttp ContentTypeError that has the status.
+    '''
+    seen = set()
+    while e is not None and id(e) not in seen:
+        seen.add(id(e))
+        if getattr(e, 'status', None) == 429 or \
+                getattr(e, 'status_code', None) == 429:
+            return True
+        message = str(e).lower()
+        if '429' in message or 'too many requests' in message or \
+                'rate limit' in message:
+            return True
+        e = e.__cause__ or e.__context__
+    return False
+
+
+class AsyncTokenBucket():
+    '''
+    asyncio rate limiter: at most rps requests per second (bursts of up to
+    burst) and at most concurrency in flight. waiting never blocks the loop.
+    use as `async with limiter:`; call backoff() when the server pushes back.
+    '''
+
+    def __init__(self, rps: float, burst: int = 1, concurrency: int = None):
+        self.rps = rps
+        self.burst = max(1, burst)
+        self.concurrency = concurrency
+        self.tokens = float(self.burst)
+        self.updated = time.monotonic()
+        self.paused_until = 0.
+        self.backoffs = 0
+        self._lock = None
+        self._semaphore = None
+
+    def _primitives(self):
+        # created lazily so they bind to the loop that actually runs them.
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+            if self.concurrency:
+                self._semaphore = asyncio.Semaphore(self.concurrency)
+        return self._lock, self._semaphore
+
+    async def acquire(self) -> None:
+        lock, semaphore = self._primitives()
+        if semaphore is not None:
+            await semaphore.acquire()
+        try:
+            async with lock:
+                while True:
+                    now = time.monotonic()
+                    if now < self.paused_until:
+                        await asyncio.sleep(self.paused_until - now)
+                        continue
+                    if not self.rps or self.rps <= 0:
+                        return
+                    self.tokens = min(
+                        self.burst, self.tokens + (now - self.updated) * self.rps)
+                    self.updated = now
+                    if self.tokens >= 1:
+                        self.tokens -= 1
+                        return
+                    await asyncio.sleep((1 - self.tokens) / self.rps)
+        except BaseException:
+            if semaphore is not None:
+                semaphore.release()
+            raise
+
+    def release(self) -> None:
+        if self._semaphore is not None:
+            self._semaphore.release()
+
+    async def __aenter__(self):
+        await self.acquire()
+        return self
+
+    async def __aexit__(self, *exc):
+        self.release()
+
+    def backoff(self, attempt: int = 0, retry_after: float = None) -> float:
+        '''pauses every request for retry_after seconds (exponential if None).'''
+        delay = retry_after if retry_after is not None else min(
+            BACKOFF_MAX, BACKOFF_BASE * 2 ** attempt) * (1 + random.random() / 2)
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        # the bucket refills from the end of the pause, not through it, so
+        # requests resume at rps instead of in a burst.
+        self.tokens = 0.
+        self.updated = self.paused_until
+        self.backoffs += 1
+        logging.warning(['rate limited; backing off', f'{delay:.1f}s'])
+        return delay
+
+    def configure(self, rps: float = None, concurrency: int = None) -> None:
+        if rps is not None:
+            self.rps = rps
+        if concurrency is not None:
+            self.concurrency = concurrency
+            self._lock = self._semaphore = None
@@ -0,0 +1,197 @@
+import os
+import time
+import logging
+import numpy as np
+from inaSpeechSegmenter.segmenter import _energy_activity, _get_patches, \
+    _binidx2seglist
+from inaSpeechSegmenter.viterbi import viterbi_decoding
+from inaSpeechSegmenter.viterbi_utils import diag_trans_exp
+
+from segment.cache import SegmentCache
+from segment.segment import BATCH_SIZE, ENERGY_RATIO, SEGMENT_OVERLAP, \
+    SEGMENT_THRES, VAD_ENGINE, SegmenterService, get_segmenter_service, \
+    sig2feats, stitch_segmentations, stream_buffers
+
+# 跨媒体批处理时每个媒体的解码窗口（秒）；每个窗口都重复推理 2 * overlap 秒，
+# 窗口太小（如 120 秒配 20 秒 overlap）会有三分之一的推理是重复的
+BATCH_WINDOW = SEGMENT_THRES
+# 攒够 batch_size 的多少倍个 patch 再推理一次
+BATCH_FILL = 16
+
+
+class _Window():
+
+    def __init__(self, media, start_sec, core, lseg, finite, rows):
+        self.media = media
+        self.start_sec = start_sec
+        self.core = core
+        self.lseg = lseg
+        self.finite = finite
+        self.rows = rows
+
+
+class BatchingSegmenter():
+    '''
+    runs the speech/music DNN over feature windows from several media at once:
+    the input patches of every submitted window are packed into full
+    inference batches, and the predictions are routed back to each media's
+    timeline. energy detection and viterbi smoothing stay per window, exactly
+    as inaSpeechSegmenter's Segmenter.segment_feats does them.
+    '''
+
+    def __init__(
+        self,
+        service: SegmenterService,
+        batch_rows: int = None,
+    ):
+        self.service = service
+        self.batch_rows = batch_rows or service.batch_size * BATCH_FILL
+        self.pending = []
+        self.pending_rows = 0
+        self.predictions = []
+        self.predicted_rows = 0
+        self.segmentations = {}
+        self.cores = {}
+        self.batches = 0
+
+    def submit(self, media: str, start_sec: float, core: list, mspec, loge, difflen):
+        vad = self.service.load().vad
+        lseg = [
+            ('energy' if lab else 'noEnergy', start, stop)
+            for lab, start, stop in _binidx2seglist(
+                _energy_activity(loge, self.service.energy_ratio)[::2])]
+        if vad.nmel < 24:
+            mspec = mspec[:, :vad.nmel].copy()
+        patches, finite = _get_patches(mspec, 68, 2)
+        if difflen > 0:
+            patches = patches[:-int(difflen / 2), :, :]
+            finite = finite[:-int(difflen / 2)]
+        rows = [patches[start:stop] for lab, start, stop in lseg
+                if lab == vad.inlabel]
+        self.pending.append(_Window(media, start_sec, core, lseg, finite, rows))
+        self.pending_rows += sum(len(x) for x in rows)
+        if self.pending_rows - self.predicted_rows >= self.batch_rows:
+            self.flush()
+
+    def _rows(self, start: int, stop: int):
+        '''rows start:stop of the pending windows' patches, concatenated.'''
+        r, offset = [], 0
+        for rows in (x for w in self.pending for x in w.rows):
+            if offset + len(rows) > start and offset < stop:
+                r.append(rows[max(0, start - offset):stop - offset])
+            offset += len(rows)
+            if offset >= stop:
+                break
+        return np.concatenate(r)
+
+    def flush(self, final: bool = False):
+        '''
+        predicts the pending patches in whole batches (everything when final),
+        then decodes every window whose patches are all predicted.
+        '''
+        vad = self.service.load().vad
+        count = self.pending_rows - self.predicted_rows
+        if not final:
+            count = count // vad.batch_size * vad.batch_size
+        if count > 0:
+            start = time.perf_counter()
+            self.predictions.append(vad.nn.predict(
+                self._rows(self.predicted_rows, self.predicted_rows + count),
+                batch_size=vad.batch_size, verbose=0))
+            self.predicted_rows += count
+            self.batches += 1
+            self.service.inference_time += time.perf_counter() - start
+            logging.debug([
+                'batched', count, 'patches from', len(self.pending),
+                'windows of', len(set(w.media for w in self.pending)), 'media'])
+        predictions = np.concatenate(self.predictions) \
+            if len(self.predictions) > 0 else None
+        offset = 0
+        while len(self.pending) > 0:
+            window = self.pending[0]
+            rows = sum(len(x) for x in window.rows)
+            if offset + rows > self.predicted_rows:
+                break
+            self.segmentations.setdefault(window.media, []).append(self._decode(
+                vad, window, predictions[offset:offset + rows] if rows else None))
+            self.cores.setdefault(window.media, []).append(window.core)
+            offset += rows
+            self.pending.pop(0)
+        self.pending_rows -= offset
+        self.predicted_rows -= offset
+        self.predictions = [predictions[offset:]] if self.predicted_rows > 0 else []
+        self.service.after_chunk()
+
+    def _decode(self, vad, window: _Window, rawpred) -> list:
+        ret = []
+        for lab, start, stop in window.lseg:
+            if lab != vad.inlabel:
+                ret.append((lab, start, stop))
+                continue
+            r = rawpred[:stop - start]
+            rawpred = rawpred[stop - start:]
+            r[window.finite[start:stop] == False, :] = 0.5  # noqa: E712
+            pred = viterbi_decoding(
+                np.log(r), diag_trans_exp(vad.viterbi_arg, len(vad.outlabels)))
+            for lab2, start2, stop2 in _binidx2seglist(pred):
+                ret.append((vad.outlabels[int(lab2)], start2 + start, stop2 + start))
+        return [(lab, window.start_sec + start * .02, window.start_sec + stop * .02)
+                for lab, start, stop in ret]
+
+    def results(self) -> dict:
+        '''flushes what is left and returns {media: stitched segmentation}.'''
+        self.flush(final=True)
+        r = {}
+        for media, segmentations in self.segmentations.items():
+            cores = self.cores[media]
+            cores[-1][1] = None
+            r[media] = stitch_segmentations(segmentations, cores)
+        return r
+
+
+def segment_batch(
+        medias: list, batch_size: int = BATCH_SIZE,
+        energy_ratio: float = ENERGY_RATIO, window_sec: int = BATCH_WINDOW,
+        overlap: int = SEGMENT_OVERLAP, cache: SegmentCache = None) -> dict:
+    '''
+    segments several media together: each is decoded once in window_sec
+    windows, round robin, and all windows share full inference batches.
+    cache: reuse (and store) the raw segmentation of identical media.
+    returns {media: segmentation}.
+    '''
+    cached, keys = {}, {}
+    for media in medias if cache is not None else []:
+        if not os.path.isfile(media):
+            continue
+        keys[media] = cache.key(
+            media, energy_ratio=energy_ratio, vad_engine=VAD_ENGINE,
+            batch_window=window_sec, overlap=overlap)
+        result = cache.get(keys[media])
+        if result is not None:
+            logging.info(['segmentation of', media, 'loaded from cache', keys[media]])
+            cached[media] = result
+    if len(cached) == len(medias):
+        return cached
+    service = get_segmenter_service(batch_size, energy_ratio)
+    batcher = BatchingSegmenter(service)
+    streams = {
+        x: stream_buffers(x, window_sec, overlap) for x in medias if x not in cached}
+    while len(streams) > 0:
+        for media in list(streams):
+            try:
+                buffer_start, core, buffer = next(streams[media])
+            except StopIteration:
+                del streams[media]
+                continue
+            mspec, loge, difflen = sig2feats(buffer)
+            batcher.submit(media, buffer_start, core, mspec, loge, difflen)
+    r = batcher.results()
+    for media, key in keys.items():
+        if media not in cached and media in r:
+            cache.put(key, r[media])
+    r.update(cached)
+    logging.info([
+        'segmented', len(medias) - len(cached), 'media in', batcher.batches,
+        'inference calls; inference', f'{service.inference_time:.2f}s;',
+        len(cached), 'from cache'])
+    return {x: r.get(x, []) for x in medias}
@@ -0,0 +1,100 @@
+import os
+import gzip
+import json
+import hashlib
+import logging
+
+from utils.paths import CACHE_DIR
+
+
+SEGMENT_CACHE_DIR = os.path.join(CACHE_DIR, 'segment')
+# 分段结果缓存的容量上限（MB），超出后淘汰最久未使用的结果
+SEGMENT_CACHE_SIZE = 512
+# 内容哈希只读取均匀分布的几块，避免读完整个几 GB 的录播
+HASH_BLOCK_SIZE = 1 << 22
+HASH_BLOCK_COUNT = 8
+
+
+def media_hash(
+        media: str, block_size: int = HASH_BLOCK_SIZE,
+        block_count: int = HASH_BLOCK_COUNT) -> str:
+    '''
+    fast content hash of media: its size plus block_count evenly spaced
+    blocks of block_size bytes (the whole file when it is small).
+    '''
+    size = os.path.getsize(media)
+    digest = hashlib.sha1(str(size).encode())
+    with open(media, 'rb') as f:
+        if size <= block_size * block_count:
+            for block in iter(lambda: f.read(block_size), b''):
+                digest.update(block)
+        else:
+            for i in range(block_count):
+                f.seek((size - block_size) * i // (block_count - 1))
+                digest.update(f.read(block_size))
+    return digest.hexdigest()
+
+
+class SegmentCache():
+    '''
+    on-disk cache of raw segment_wrapper output, keyed by the media content
+    hash and the segmenter parameters. entries are gzipped json files; the
+    least recently used ones are evicted once the cache outgrows max_size MB.
+    '''
+
+    def __init__(
+        self,
+        cache_dir: str = SEGMENT_CACHE_DIR,
+        max_size: int = SEGMENT_CACHE_SIZE,
+    ):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def key(self, media: str, **params) -> str:
+        return hashlib.sha1(json.dumps(
+            [media_hash(media), params], sort_keys=True).encode()).hexdigest()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key + '.json.gz')
+
+    def get(self, key: str):
+        path = self._path(key)
+        try:
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                segmentation = [tuple(x) for x in json.load(f)]
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError):
+            logging.warning(['segment cache entry', path, 'is corrupted; ignoring.'])
+            return None
+        # mtime doubles as the last access time for LRU eviction.
+        os.utime(path)
+        return segmentation
+
+    def put(self, key: str, segmentation: list) -> None:
+        path = self._path(key)
+        temp_path = f'{path}.{os.getpid()}.tmp'
+        with gzip.open(temp_path, 'wt', encoding='utf-8') as f:
+            json.dump(segmentation, f)
+        os.replace(temp_path, path)
+        self.evict()
+
+    def evict(self) -> None:
+        entries = []
+        for name in os.listdir(self.cache_dir):
+            try:
+                stat = os.stat(os.path.join(self.cache_dir, name))
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, name))
+        total = sum(x[1] for x in entries)
+        for _, size, name in sorted(entries):
+            if total <= self.max_size * 1024 * 1024:
+                break
+            try:
+                os.remove(os.path.join(self.cache_dir, name))
+                logging.debug(['evicted', name, 'from segment cache'])
+            except FileNotFoundError:
+                pass
+            total -= size
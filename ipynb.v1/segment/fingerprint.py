@@ -0,0 +1,199 @@
+'''
+local landmark fingerprint index of clips shazam already identified.
+
+python -m segment.fingerprint --index /inaseg
+'''
+import os
+import glob
+import json
+import logging
+import sqlite3
+import threading
+from collections import Counter
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from utils.ffmpeg import media_info, pcm_window
+from utils.paths import CACHE_DIR
+
+
+FINGERPRINT_PATH = os.path.join(CACHE_DIR, 'fingerprint.sqlite')
+# 指纹解码采样率与 FFT 参数（8k 下 512 点约 64ms 一帧，步长 32ms）
+FP_SAMPLE_RATE = 8000
+FP_FFT = 512
+FP_HOP = 256
+# 峰值邻域（帧, 频点），以及峰值需高出整段均值的对数幅度
+FP_PEAK_TIME = 5
+FP_PEAK_FREQ = 10
+FP_PEAK_LEVEL = 2.
+# 每个锚点配对的峰值数与最大帧距
+FP_FAN_OUT = 5
+FP_MAX_DT = 63
+# 查询时解码片段中间的秒数
+FP_QUERY_WINDOW = 20
+# 对齐的指纹数至少这么多、且是第二名的这么多倍才算本地命中
+FP_MIN_MATCHES = 15
+FP_MIN_RATIO = 2.
+
+
+def _sliding_max(x: np.ndarray, size: int, axis: int) -> np.ndarray:
+    pad = [(0, 0)] * x.ndim
+    pad[axis] = (size, size)
+    padded = np.pad(x, pad, constant_values=-np.inf)
+    return sliding_window_view(padded, 2 * size + 1, axis=axis).max(axis=-1)
+
+
+def spectral_peaks(samples: np.ndarray):
+    '''(frame, bin) arrays of the local maxima of the log spectrogram.'''
+    if len(samples) < FP_FFT:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    frames = sliding_window_view(samples.astype(np.float32), FP_FFT)[::FP_HOP]
+    spec = np.log(np.abs(np.fft.rfft(frames * np.hanning(FP_FFT), axis=1)) + 1e-6)
+    neighborhood = _sliding_max(_sliding_max(spec, FP_PEAK_TIME, 0), FP_PEAK_FREQ, 1)
+    return np.nonzero((spec == neighborhood) & (spec > spec.mean() + FP_PEAK_LEVEL))
+
+
+def landmarks(samples: np.ndarray) -> list:
+    '''[(hash, anchor frame), ...]: each peak paired with the next FP_FAN_OUT ones.'''
+    times, freqs = spectral_peaks(samples)
+    order = np.lexsort((freqs, times))
+    times, freqs = times[order], freqs[order]
+    r = []
+    for i in range(len(times)):
+        for j in range(i + 1, min(i + 1 + FP_FAN_OUT, len(times))):
+            dt = times[j] - times[i]
+            if dt > FP_MAX_DT:
+                break
+            if dt == 0:
+                continue
+            r.append((int(freqs[i]) << 15 | int(freqs[j]) << 6 | int(dt), int(times[i])))
+    return r
+
+
+def _samples(file: str, offset: float = 0., window: float = None) -> np.ndarray:
+    window = window or media_info(file).duration
+    return np.frombuffer(
+        pcm_window(file, offset, window, FP_SAMPLE_RATE), dtype=np.int16)
+
+
+class FingerprintIndex():
+    '''
+    sqlite hash table of spectral peak landmarks -> (clip, frame) of clips
+    shazam identified, with their track payloads. a clip matches locally when
+    enough of its landmarks line up at one time offset in one indexed clip.
+    '''
+
+    def __init__(self, path: str = FINGERPRINT_PATH):
+        self.path = path
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS clips ('
+                'id INTEGER PRIMARY KEY, source TEXT UNIQUE, track TEXT)')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS landmarks ('
+                'hash INTEGER, clip INTEGER, time INTEGER)')
+            self.db.execute(
+                'CREATE INDEX IF NOT EXISTS landmarks_hash ON landmarks (hash)')
+
+    def add(self, file: str, track: dict) -> bool:
+        '''indexes file as track; False if it was indexed already.'''
+        source = os.path.basename(file)
+        with self.lock:
+            if self.db.execute(
+                    'SELECT 1 FROM clips WHERE source = ?', (source,)).fetchone():
+                return False
+        marks = landmarks(_samples(file))
+        with self.lock, self.db:
+            clip = self.db.execute(
+                'INSERT INTO clips (source, track) VALUES (?, ?)',
+                (source, json.dumps(track, ensure_ascii=False))).lastrowid
+            self.db.executemany(
+                'INSERT INTO landmarks VALUES (?, ?, ?)',
+                [(h, clip, t) for h, t in marks])
+        logging.info(['fingerprinted', source, len(marks), 'landmarks'])
+        return True
+
+    def match(self, file: str):
+        '''the track of the indexed clip file matches, or None.'''
+        duration = media_info(file).duration
+        offset = max(0., duration / 2 - FP_QUERY_WINDOW / 2)
+        marks = landmarks(_samples(file, offset, FP_QUERY_WINDOW))
+        query = {}
+        for h, t in marks:
+            query.setdefault(h, []).append(t)
+        votes = Counter()
+        hashes = list(query)
+        with self.lock:
+            for i in range(0, len(hashes), 500):
+                chunk = hashes[i:i + 500]
+                for h, clip, t in self.db.execute(
+                        'SELECT hash, clip, time FROM landmarks WHERE hash IN '
+                        f"({','.join('?' * len(chunk))})", chunk):
+                    for qt in query[h]:
+                        votes[clip, t - qt] += 1
+        best = {}
+        for (clip, _), count in votes.items():
+            best[clip] = max(best.get(clip, 0), count)
+        ranked = sorted(best.items(), key=lambda x: -x[1])
+        if len(ranked) == 0 or ranked[0][1] < FP_MIN_MATCHES:
+            return None
+        if len(ranked) > 1 and ranked[0][1] < ranked[1][1] * FP_MIN_RATIO:
+            # several clips of the same track may all line up; only refuse
+            # when the runner up is a different track.
+            tracks = self._tracks([ranked[0][0], ranked[1][0]])
+            if tracks[0] != tracks[1]:
+                return None
+        return self._tracks([ranked[0][0]])[0]
+
+    def _tracks(self, clips: list) -> list:
+        with self.lock:
+            return [json.loads(self.db.execute(
+                'SELECT track FROM clips WHERE id = ?', (x,)).fetchone()[0])
+                for x in clips]
+
+    def index_dir(self, outdir: str, cache=None) -> int:
+        '''
+        indexes the renamed "..._title by artist" clips in outdir, with the
+        payload cached by segment.shazamcache when there is one.
+        '''
+        count = 0
+        for file in glob.glob(os.path.join(outdir, '* by *.*')):
+            stem = os.path.splitext(os.path.basename(file))[0]
+            by = stem.rfind(' by ')
+            track = None
+            if cache is not None:
+                try:
+                    track = cache.get(cache.key(file))
+                except Exception:
+                    track = None
+            if track is None:
+                track = {
+                    'title': stem[stem.rfind('_', 0, by) + 1:by],
+                    'subtitle': stem[by + len(' by '):]}
+            try:
+                count += self.add(file, track)
+            except Exception:
+                logging.warning([file, 'could not be fingerprinted'])
+        return count
+
+    def close(self) -> None:
+        self.db.close()
+
+
+if __name__ == '__main__':
+    import argparse
+    from segment.shazamcache import ShazamCache
+    parser = argparse.ArgumentParser(description='local fingerprint index')
+    parser.add_argument(
+        '--index', type=str, nargs='+', required=True,
+        help='directories of shazamed clips to index')
+    parser.add_argument('--path', type=str, default=FINGERPRINT_PATH)
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO)
+    index = FingerprintIndex(args.path)
+    cache = ShazamCache()
+    for outdir in args.index:
+        logging.info(['indexed', index.index_dir(outdir, cache), 'clips from', outdir])
@@ -0,0 +1,135 @@
+import numpy as np
+
+# 识歌分段最小阈值（秒），调大了会漏 调小了会多杂谈
+EXTRACT_SEG_THRES = 60
+# 最终识歌分段最小阈值（秒），调大了漏TV size 调小了多杂谈
+EXTRACT_SEG_THRES_FINAL = 80
+# 识歌分段连接的阈值（秒），调大了会两首歌分不开 调小了会碎
+EXTRACT_SEG_CONNECT = 5
+# extract_music 使用的标签编码
+LABEL_CODES = {'noEnergy': 0, 'music': 1, 'speech': 2, 'noise': 3}
+
+
+def segmentation_to_arrays(segmentation: list):
+    '''
+    [(label, start, stop), ...] -> (label codes, starts, stops) arrays.
+    labels missing from LABEL_CODES get codes after the known ones.
+    '''
+    codes = dict(LABEL_CODES)
+    count = len(segmentation)
+    labels = np.fromiter(
+        (codes.setdefault(x[0], len(codes)) for x in segmentation),
+        dtype=np.int32, count=count)
+    starts = np.fromiter((x[1] for x in segmentation), dtype=np.float64, count=count)
+    stops = np.fromiter((x[2] for x in segmentation), dtype=np.float64, count=count)
+    return labels, starts, stops
+
+
+def _run_ends(flags: np.ndarray) -> np.ndarray:
+    '''for every index, the first index at or after it where flags is False.'''
+    index = np.arange(len(flags))
+    return np.minimum.accumulate(
+        np.where(flags, len(flags), index)[::-1])[::-1]
+
+
+def _bridge_no_energy(labels, starts, stops):
+    '''
+    extends the run before every short noEnergy gap to the end of the run
+    after it, when both sides share a label; chains of gaps extend all the
+    way to the end of the chain, exactly like the backwards loop did.
+    '''
+    stops = stops.copy()
+    if len(labels) < 3:
+        return stops
+    no_energy = labels == LABEL_CODES['noEnergy']
+    if np.any(no_energy[:-2] & no_energy[1:-1] & no_energy[2:]):
+        # 3+ noEnergy runs in a row (chunk seams) let a bridge change the
+        # length of the next gap to test; keep the sequential semantics there.
+        for i in range(len(labels) - 2, 0, -1):
+            if no_energy[i] and stops[i] - starts[i] < 4 and \
+                    labels[i - 1] == labels[i + 1]:
+                stops[i - 1] = stops[i + 1]
+        return stops
+    bridge = np.zeros(len(labels), dtype=bool)
+    bridge[1:-1] = no_energy[1:-1] & (stops[1:-1] - starts[1:-1] < 4) & \
+        (labels[:-2] == labels[2:])
+    original = stops.copy()
+    # gap i bridges run i-1 to run i+1, which may itself be bridged by gap
+    # i+2: chains live on one parity, and end at their last bridging gap.
+    for parity in (1, 2):
+        flags = bridge[parity::2]
+        gaps = np.nonzero(flags)[0]
+        last = _run_ends(flags)[gaps] - 1
+        stops[parity + 2 * gaps - 1] = original[parity + 2 * last + 1]
+    return stops
+
+
+def extract_music(
+        segmentation, segment_thres=EXTRACT_SEG_THRES,
+        segment_thres_final=EXTRACT_SEG_THRES_FINAL,
+        segment_connect=EXTRACT_SEG_CONNECT, start_padding=1, end_padding=4):
+    '''
+    array based extract_music: same rules and output as
+    extract_music_reference, without mutating segmentation. segmentation is
+    either the segmenter's list or a segmentation_to_arrays tuple.
+    '''
+    labels, starts, stops = segmentation if isinstance(segmentation, tuple) \
+        else segmentation_to_arrays(segmentation)
+    stops = _bridge_no_energy(labels, starts, stops)
+    music = (labels == LABEL_CODES['music']) & (stops - starts > segment_thres)
+    r_starts = starts[music] - start_padding
+    r_stops = stops[music] + end_padding
+    # run k joins run k-1 when the gap between them is below segment_connect;
+    # a joined run hands its stop to the first run of its chain and is voided.
+    joined = np.zeros(len(r_starts), dtype=bool)
+    joined[1:] = r_starts[1:] - r_stops[:-1] < segment_connect
+    chain_ends = np.append(_run_ends(joined)[1:], len(joined)) - 1
+    r_stops = r_stops[chain_ends] if len(joined) else r_stops
+    r_starts = np.where(joined, r_stops + 1, r_starts)
+    keep = (r_starts >= 5) & (r_stops - r_starts > segment_thres_final)
+    return [['{}:{}:{}'.format(str(int(x[0]//3600)),
+                               str(int(x[0] % 3600 // 60)),
+                               str(int(x[0] % 60)).zfill(2)),
+             '{}:{}:{}'.format(str(int(x[1]//3600)),
+                               str(int(x[1] % 3600 // 60)),
+                               str(int(x[1] % 60)).zfill(2))]
+            for x in zip(r_starts[keep].tolist(), r_stops[keep].tolist())]
+
+
+def extract_music_reference(
+        segmentation, segment_thres=EXTRACT_SEG_THRES,
+        segment_thres_final=EXTRACT_SEG_THRES_FINAL,
+        segment_connect=EXTRACT_SEG_CONNECT, start_padding=1, end_padding=4):
+    '''
+    the original list based extract_music, kept to check the vectorized
+    version against. note that it bridges noEnergy runs in place.
+    '''
+    r = []
+    # bridges noEnergy segments that are likely fragmented
+    for i in range(len(segmentation)-2, 0, -1):
+        if segmentation[i][0] == 'noEnergy' and \
+                segmentation[i][2] - segmentation[i][1] < 4 and \
+                segmentation[i-1][0] == segmentation[i+1][0]:
+            segmentation[i-1] = (
+                segmentation[i-1][0],
+                segmentation[i-1][1],
+                segmentation[i+1][2])
+    for i in segmentation:
+        if i[0] == 'music' and i[2]-i[1] > segment_thres:
+            r.append(['', i[1] - start_padding, i[2] + end_padding])
+    for i in range(len(r)-1, 0, -1):
+        if r[i][1] - r[i-1][2] < segment_connect:
+            r[i-1][2] = r[i][2]
+            r[i][1] = r[i][2] + 1
+    rf = []
+    for i in r:
+        if i[1] < 5:
+            continue
+        if i[2]-i[1] > segment_thres_final:
+            rf.append(i)
+    return [['{}:{}:{}'.format(str(int(x[1]//3600)),
+                               str(int(x[1] % 3600 // 60)),
+                               str(int(x[1] % 60)).zfill(2)),
+             '{}:{}:{}'.format(str(int(x[2]//3600)),
+                               str(int(x[2] % 3600 // 60)),
+                               str(int(x[2] % 60)).zfill(2))] for x in rf]
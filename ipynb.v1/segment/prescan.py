@@ -0,0 +1,90 @@
+import time
+import logging
+import numpy as np
+
+from utils.ffmpeg import pcm_windows
+
+# 能量预扫描的解码采样率，只看能量不需要高采样率
+PRESCAN_SAMPLE_RATE = 4000
+# 能量帧长（秒），与 inaSpeechSegmenter 的 20ms 帧一致
+PRESCAN_FRAME = 0.02
+# 每次从管道读取的秒数
+PRESCAN_WINDOW = 60
+# 低能量持续超过此秒数才跳过，短暂停顿仍交给模型
+PRESCAN_MIN_SILENCE = 60
+# 跳过的区间两端各留给模型的秒数
+PRESCAN_MARGIN = 5
+
+
+def energy_envelope(media: str, sample_rate: int = PRESCAN_SAMPLE_RATE,
+                    frame: float = PRESCAN_FRAME) -> np.ndarray:
+    '''log energy of every frame seconds of media, decoded at sample_rate.'''
+    frame_samples = int(sample_rate * frame)
+    envelope, rest = [], np.zeros(0, dtype=np.float64)
+    for _, samples in pcm_windows(media, PRESCAN_WINDOW, sample_rate):
+        samples = np.concatenate([rest, samples.astype(np.float64)])
+        count = len(samples) // frame_samples
+        rest = samples[count * frame_samples:]
+        frames = samples[:count * frame_samples].reshape(count, frame_samples)
+        with np.errstate(divide='ignore'):
+            envelope.append(np.log(np.mean(frames ** 2, axis=1)))
+    return np.concatenate(envelope) if envelope else np.zeros(0)
+
+
+def silent_regions(
+        media: str, energy_ratio: float, min_silence: float = PRESCAN_MIN_SILENCE,
+        margin: float = PRESCAN_MARGIN, frame: float = PRESCAN_FRAME) -> list:
+    '''
+    [[start_sec, stop_sec], ...] of media that stays below the energy
+    threshold inaSpeechSegmenter would use (mean log energy + log ratio) for
+    over min_silence seconds, shrunk by margin seconds on both ends.
+    '''
+    start = time.perf_counter()
+    loge = energy_envelope(media, frame=frame)
+    finite = np.isfinite(loge)
+    if not finite.any():
+        return [[0, float(len(loge) * frame)]] if len(loge) else []
+    quiet = loge <= np.mean(loge[finite]) + np.log(energy_ratio)
+    # run boundaries of quiet frames
+    edges = np.flatnonzero(np.diff(np.concatenate([[0], quiet.astype(np.int8), [0]])))
+    regions = []
+    for run_start, run_stop in zip(edges[::2], edges[1::2]):
+        if (run_stop - run_start) * frame < min_silence:
+            continue
+        region_start = run_start * frame + margin if run_start > 0 else 0
+        region_stop = run_stop * frame - margin if run_stop < len(loge) else \
+            run_stop * frame
+        regions.append([float(region_start), float(region_stop)])
+    duration = len(loge) * frame
+    skipped = sum(x[1] - x[0] for x in regions)
+    logging.info([
+        'energy prescan of', media, 'skips', f'{skipped:.0f}s of {duration:.0f}s',
+        f'({skipped / duration:.1%})' if duration else '',
+        'in', f'{time.perf_counter() - start:.2f}s'])
+    return regions
+
+
+def skip_silent(cores: list, silent: list):
+    '''
+    cuts [start_sec, stop_sec] cores (None for an open end) around the silent
+    regions; returns the new cores and, for each, whether it is silent.
+    '''
+    result, skipped = [], []
+    for core_start, core_stop in cores:
+        position = core_start
+        for silent_start, silent_stop in silent:
+            if silent_stop <= (position or 0) or \
+                    (core_stop is not None and silent_start >= core_stop):
+                continue
+            if (position or 0) < silent_start:
+                result.append([position, silent_start])
+                skipped.append(False)
+            position = max(position or 0, silent_start)
+            end = silent_stop if core_stop is None else min(silent_stop, core_stop)
+            result.append([position, end])
+            skipped.append(True)
+            position = end
+        if core_stop is None or (position or 0) < core_stop:
+            result.append([position, core_stop])
+            skipped.append(False)
+    return result, skipped
@@ -1,103 +1,444 @@
 #  Load the API
 from inaSpeechSegmenter import Segmenter  # noqa: E402
+from inaSpeechSegmenter.sidekit_mfcc import mfcc
 import os
-from threading import Thread
+import shutil
+import tempfile
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
 import gc
+import time
+import warnings
 import logging
+import numpy as np
 import tensorflow as tf
 
-from utils.ffmpeg import get_segment_process_length_array, ffmpeg
+from utils.ffmpeg import get_segment_process_length_array, pcm_windows, \
+    get_ffmpeg_executor, FFmpegResult
 from utils.timestamp import fix_missing_stamps, sec2timestamp
-from utils.logging import save_timestamps
+from utils.keyframes import get_keyframe_index, cut_cmd
+from utils.logging import save_timestamps, SAVE_YAML_PATH
+from utils.memory import SEGMENT_THRES_AUTO, SEGMENT_THRES_MIN, \
+    auto_segment_length, current_rss, get_memory_profile, memory_pressure, \
+    peak_rss
+from segment.cache import SegmentCache
+from segment.prescan import silent_regions, skip_silent
+from segment.stitch import STITCH_TOLERANCE, pad_segment_ranges, \
+    stitch_segmentations, segmentation_agreement  # noqa: F401
+from segment.music import EXTRACT_SEG_THRES, EXTRACT_SEG_THRES_FINAL, \
+    EXTRACT_SEG_CONNECT, LABEL_CODES, segmentation_to_arrays, extract_music, \
+    extract_music_reference  # noqa: F401
 
 # 媒体流最大时长处理（秒）；1G内存的进程推荐用10分钟/600秒，16G可以支持5小时，6GB VRAM可以支持5小时左右。
+# 读不到可用内存时，自动分段（SEGMENT_THRES_AUTO）也用这个值。
 SEGMENT_THRES = 800
-# 识歌分段最小阈值（秒），调大了会漏 调小了会多杂谈
-EXTRACT_SEG_THRES = 60
-# 最终识歌分段最小阈值（秒），调大了漏TV size 调小了多杂谈
-EXTRACT_SEG_THRES_FINAL = 80
-# 识歌分段连接的阈值（秒），调大了会两首歌分不开 调小了会碎
-EXTRACT_SEG_CONNECT = 5
 # 大了会碎 小了会两首歌分不开
 ENERGY_RATIO = 0.03
 # 8GB VRAM 推荐 256
 BATCH_SIZE = 32
+VAD_ENGINE = 'sm'
+# 模型释放策略：process 进程内常驻，media 每个媒体后释放，chunk 每段都重新加载（旧行为）
+SEGMENTER_RELEASE_POLICY = 'process'
+RELEASE_POLICIES = ('process', 'media', 'chunk')
+# 模型预热用的特征帧数
+WARMUP_FRAMES = 200
+# 分段处理时每段两侧额外重叠的秒数，拼接时裁掉，避免歌曲在分段边界被切断
+SEGMENT_OVERLAP = 20
+# 流式解码的采样率（inaSpeechSegmenter 固定 16k 单声道）
+STREAM_SAMPLE_RATE = 16000
+# 流式解码时短于此长度（秒）的尾部窗口直接丢弃
+STREAM_MIN_WINDOW = 1
 
 
 class TimestampMismatch(Exception):
     pass
 
 # select a media to analyse
-#  any media supported by ffmpeg may be used (video, audio, urls)
+#  any media supported by ffmpeg may be used (video, audio, urls)
+
+
+class SegmenterService():
+    '''
+    keeps one inaSpeechSegmenter Segmenter (and its keras models) loaded and
+    warmed up, so every chunk of every media reuses the same model.
+    release_policy decides when the model is dropped:
+        process: kept for the lifetime of the process (default)
+        media: dropped after each media is segmented
+        chunk: dropped after every chunk (the old clear_session behavior)
+    '''
+
+    def __init__(
+        self,
+        batch_size: int = BATCH_SIZE,
+        energy_ratio: float = ENERGY_RATIO,
+        vad_engine: str = VAD_ENGINE,
+        release_policy: str = SEGMENTER_RELEASE_POLICY,
+    ):
+        if release_policy not in RELEASE_POLICIES:
+            raise ValueError(
+                f'release_policy must be one of {RELEASE_POLICIES}, '
+                f'got {release_policy}')
+        self.batch_size = batch_size
+        self.energy_ratio = energy_ratio
+        self.vad_engine = vad_engine
+        self.release_policy = release_policy
+        self.segmenter = None
+        self.loads = 0
+        self.chunks = 0
+        self.load_time = 0.
+        self.inference_time = 0.
+
+    def load(self) -> Segmenter:
+        if self.segmenter is not None:
+            return self.segmenter
+        start = time.perf_counter()
+        self.segmenter = Segmenter(
+            vad_engine=self.vad_engine,
+            detect_gender=False,
+            energy_ratio=self.energy_ratio,
+            batch_size=self.batch_size)
+        self._warmup()
+        elapsed = time.perf_counter() - start
+        self.load_time += elapsed
+        self.loads += 1
+        logging.info(['segmenter model loaded in', f'{elapsed:.2f}s'])
+        return self.segmenter
+
+    def _warmup(self):
+        # a tiny synthetic pass builds the predict graph before real media arrives.
+        rng = np.random.RandomState(0)
+        try:
+            self.segmenter.segment_feats(
+                rng.randn(WARMUP_FRAMES, 24).astype(np.float32),
+                rng.randn(WARMUP_FRAMES).astype(np.float32), 0, 0)
+        except Exception:
+            logging.warning('segmenter warmup failed; continuing without it.')
+
+    def __call__(self, media: str, start_sec: int = None, stop_sec: int = None):
+        segmenter = self.load()
+        rss_before, peak_before = current_rss(), peak_rss()
+        start = time.perf_counter()
+        segmentation = segmenter(media, start_sec=start_sec, stop_sec=stop_sec)
+        self.inference_time += time.perf_counter() - start
+        if stop_sec is not None:
+            get_memory_profile().observe(
+                stop_sec - (start_sec or 0), rss_before, peak_before, peak_rss())
+        self.chunks += 1
+        self.after_chunk()
+        return segmentation
+
+    def segment_stream(
+            self, media: str, window_sec: int = SEGMENT_THRES,
+            overlap: int = 0, silent: list = None) -> list:
+        '''
+        decodes media once through an ffmpeg PCM pipe and segments it in
+        window_sec windows; peak RAM follows window_sec, not the media length.
+        silent: [[start_sec, stop_sec], ...] from segment.prescan, labelled
+        noEnergy; windows that lie inside one are decoded but not segmented.
+        '''
+        segmenter = self.load()
+        segmentations, cores = [], []
+        silent = silent or []
+        for buffer_start, core, buffer in stream_buffers(media, window_sec, overlap):
+            if any(x[0] <= (core[0] or 0) and core[1] <= x[1] for x in silent):
+                logging.debug(['skipping silent stream window', core])
+                segmentations.append([])
+                cores.append(core)
+                continue
+            start = time.perf_counter()
+            mspec, loge, difflen = sig2feats(buffer)
+            segmentations.append(
+                segmenter.segment_feats(mspec, loge, difflen, buffer_start))
+            cores.append(core)
+            self.inference_time += time.perf_counter() - start
+            self.chunks += 1
+            del buffer, mspec, loge
+            self.after_chunk()
+            segmenter = self.load()
+        if cores:
+            cores[-1][1] = None
+        result = stitch_segmentations(segmentations, cores)
+        if len(silent) == 0:
+            return result
+        regions, skipped = skip_silent([[None, None]], silent)
+        return stitch_segmentations([
+            [('noEnergy', x[0] or 0, x[1])] if y else result
+            for x, y in zip(regions, skipped)], regions)
+
+    def after_chunk(self):
+        gc.collect()
+        if self.release_policy == 'chunk':
+            self.release()
+
+    def after_media(self):
+        if self.release_policy == 'media':
+            self.release()
+
+    def release(self):
+        '''drops the loaded model and frees the keras graph.'''
+        if self.segmenter is None:
+            return
+        self.segmenter = None
+        gc.collect()
+        tf.keras.backend.clear_session()
+
+    def stats(self) -> dict:
+        return {
+            'loads': self.loads,
+            'chunks': self.chunks,
+            'load_time': self.load_time,
+            'inference_time': self.inference_time,
+        }
+
+
+def stream_buffers(media: str, window_sec: int = SEGMENT_THRES, overlap: int = 0):
+    '''
+    yields (buffer_start_sec, core, samples) for consecutive window_sec
+    windows of media decoded in one pass. each buffer also carries the last
+    2 * overlap seconds of the previous one, so its core ([start_sec,
+    stop_sec], trimmed by overlap on both sides) has context on both sides.
+    the caller sets the last core's stop to None once the stream ends.
+    '''
+    if window_sec == SEGMENT_THRES_AUTO:
+        window_sec = auto_segment_length(SEGMENT_THRES)
+    carry = int(2 * overlap * STREAM_SAMPLE_RATE)
+    tail = np.zeros(0, dtype=np.int16)
+    first = True
+    for start_sec, sig in pcm_windows(media, window_sec, STREAM_SAMPLE_RATE):
+        buffer = np.concatenate((tail, sig)) if len(tail) else sig
+        buffer_start = start_sec - len(tail) / STREAM_SAMPLE_RATE
+        buffer_stop = start_sec + len(sig) / STREAM_SAMPLE_RATE
+        tail = buffer[-carry:].copy() if carry else tail
+        del sig
+        if len(buffer) < STREAM_MIN_WINDOW * STREAM_SAMPLE_RATE:
+            logging.debug(['dropping trailing window at', sec2timestamp(start_sec)])
+            continue
+        logging.info([
+            'segmenting', media, 'stream window from',
+            sec2timestamp(buffer_start), 'to', sec2timestamp(buffer_stop)])
+        yield buffer_start, [
+            None if first else start_sec - overlap, buffer_stop - overlap], buffer
+        first = False
+
+
+def sig2feats(sig: np.ndarray):
+    '''
+    16k mono s16 samples -> (mspec, loge, difflen), mirroring
+    inaSpeechSegmenter's own feature extraction for decoded media.
+    '''
+    with warnings.catch_warnings():
+        # silent windows produce log(0) warnings inside sidekit
+        warnings.simplefilter('ignore', RuntimeWarning)
+        _, loge, _, mspec = mfcc(
+            sig.astype(np.float32) / 32768, get_mspec=True)
+    difflen = 0
+    if len(loge) < 68:
+        difflen = 68 - len(loge)
+        mspec = np.concatenate((mspec, np.ones((difflen, 24)) * np.min(mspec)))
+    return mspec, loge, difflen
+
+
+_SEGMENTER_SERVICES = {}
+
+
+def get_segmenter_service(
+        batch_size: int = BATCH_SIZE, energy_ratio: float = ENERGY_RATIO,
+        vad_engine: str = VAD_ENGINE,
+        release_policy: str = SEGMENTER_RELEASE_POLICY) -> SegmenterService:
+    '''returns the process wide SegmenterService for these parameters.'''
+    key = (vad_engine, batch_size, energy_ratio)
+    if key not in _SEGMENTER_SERVICES:
+        _SEGMENTER_SERVICES[key] = SegmenterService(
+            batch_size=batch_size, energy_ratio=energy_ratio,
+            vad_engine=vad_engine, release_policy=release_policy)
+    service = _SEGMENTER_SERVICES[key]
+    service.release_policy = release_policy
+    return service
 
 
 def segment(
         media: str, batch_size: int = BATCH_SIZE, energy_ratio: float = ENERGY_RATIO,
         start_sec: int = None, stop_sec: int = None):
-    segmenter = Segmenter(
-        vad_engine='sm',
-        detect_gender=False,
-        energy_ratio=energy_ratio,
-        batch_size=batch_size)
-    segmentation = segmenter(media, start_sec=start_sec, stop_sec=stop_sec)
-    return segmentation
+    return get_segmenter_service(batch_size, energy_ratio)(
+        media, start_sec=start_sec, stop_sec=stop_sec)
+
+
+def _init_segment_worker(batch_size: int, energy_ratio: float, threads: int):
+    # each worker process splits the cores with its siblings and owns one model.
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    get_segmenter_service(batch_size, energy_ratio).load()
+
+
+def _segment_chunk(
+        media: str, start_sec: int, stop_sec: int,
+        batch_size: int, energy_ratio: float):
+    return get_segmenter_service(batch_size, energy_ratio)(
+        media, start_sec=start_sec, stop_sec=stop_sec)
+
+
+def segment_parallel(
+        media: str, chunks: list, workers: int, batch_size: int = BATCH_SIZE,
+        energy_ratio: float = ENERGY_RATIO) -> list:
+    '''
+    segments chunks ([start_sec, stop_sec] pairs) on a pool of worker
+    processes, each with its own model; returns one segmentation per chunk
+    in timeline order.
+    '''
+    workers = min(workers, len(chunks))
+    threads = max(1, (os.cpu_count() or 1) // workers)
+    logging.info([
+        'segmenting', media, 'in', len(chunks), 'chunks on', workers,
+        'worker processes with', threads, 'threads each'])
+    with ProcessPoolExecutor(
+            max_workers=workers,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_segment_worker,
+            initargs=(batch_size, energy_ratio, threads)) as pool:
+        return list(pool.map(
+            _segment_chunk,
+            [media] * len(chunks),
+            [x[0] for x in chunks],
+            [x[1] for x in chunks],
+            [batch_size] * len(chunks),
+            [energy_ratio] * len(chunks)))
 
 
 def segment_wrapper(
         media: str, batch_size: int = BATCH_SIZE,
-        energy_ratio: float = ENERGY_RATIO, segment_length_thres: int = 0):
-    ''''''
-    result = []
-    for i in get_segment_process_length_array(media, segment_length_thres):
+        energy_ratio: float = ENERGY_RATIO, segment_length_thres: int = 0,
+        release_policy: str = SEGMENTER_RELEASE_POLICY, stream: bool = False,
+        workers: int = 1, overlap: int = SEGMENT_OVERLAP,
+        cache: SegmentCache = None, prescan: bool = False,
+        cache_media: str = None):
+    '''
+    stream: decode media once through a PCM pipe instead of one seeking
+    ffmpeg decode per chunk; segment_length_thres is then the window size.
+    workers: segment the chunks on this many worker processes.
+    overlap: seconds each chunk is widened by on both sides; chunk results
+    are clipped back and stitched at the boundaries.
+    cache: reuse the raw segmentation of an identical media and parameters.
+    cache_media: the file hashed for the cache key instead of media, when
+    media is a scratch copy of it (eg its extracted audio).
+    prescan: label long low energy stretches noEnergy from a cheap energy
+    envelope and only run the model on the rest; with stream, windows that
+    are all silent skip the model.
+    '''
+    cache_media = cache_media or media
+    if cache is None or not os.path.isfile(cache_media):
+        return _segment_wrapper(
+            media, batch_size, energy_ratio, segment_length_thres,
+            release_policy, stream, workers, overlap, prescan)
+    key = cache.key(
+        cache_media, energy_ratio=energy_ratio, vad_engine=VAD_ENGINE,
+        segment_length_thres=segment_length_thres, stream=stream,
+        overlap=overlap, prescan=prescan)
+    result = cache.get(key)
+    if result is not None:
+        logging.info(['segmentation of', media, 'loaded from cache', key])
+        return result
+    result = _segment_wrapper(
+        media, batch_size, energy_ratio, segment_length_thres,
+        release_policy, stream, workers, overlap, prescan)
+    cache.put(key, result)
+    return result
+
+
+def _segment_wrapper(
+        media: str, batch_size: int, energy_ratio: float,
+        segment_length_thres: int, release_policy: str, stream: bool,
+        workers: int, overlap: int, prescan: bool = False):
+    service = get_segmenter_service(
+        batch_size, energy_ratio, release_policy=release_policy)
+    load_time, inference_time = service.load_time, service.inference_time
+    if stream:
+        if workers > 1:
+            logging.warning('streaming segmentation runs on a single worker.')
+        result = service.segment_stream(
+            media, window_sec=segment_length_thres or SEGMENT_THRES,
+            overlap=overlap,
+            silent=silent_regions(media, energy_ratio) if prescan else None)
+        service.after_media()
+        return result
+    cores = get_segment_process_length_array(
+        media, segment_length_thres, workers, SEGMENT_THRES)
+    skipped = [False] * len(cores)
+    if prescan:
+        cores, skipped = skip_silent(cores, silent_regions(media, energy_ratio))
+    silent = [tuple(x) for x, y in zip(cores, skipped) if y]
+    if workers > 1 and len(cores) - len(silent) > 1:
+        start = time.perf_counter()
+        active = iter(segment_parallel(
+            media, pad_segment_ranges(
+                [x for x, y in zip(cores, skipped) if not y], overlap),
+            workers, batch_size, energy_ratio))
+        segmentations = [
+            [('noEnergy', x[0] or 0, x[1])] if y else next(active)
+            for x, y in zip(cores, skipped)]
+        logging.info([
+            'segmented', media, 'in parallel in',
+            f'{time.perf_counter() - start:.2f}s'])
+        return stitch_segmentations(segmentations, cores)
+    segmentations, segmented_cores = [], []
+    pending = cores[::-1]
+    while len(pending) > 0:
+        core = pending.pop()
+        if tuple(core) in silent:
+            segmentations.append([('noEnergy', core[0] or 0, core[1])])
+            segmented_cores.append(core)
+            continue
+        if memory_pressure() and _split_core(core, pending):
+            logging.warning(['memory pressure detected; halving chunk', core])
+            continue
+        i = pad_segment_ranges([core], overlap)[0]
         logging.info([
             'segmenting', media, 'from',
             sec2timestamp(i[0]), 'to', sec2timestamp(i[1])])
-        result += segment(
-            media, batch_size, energy_ratio,
-            start_sec=i[0], stop_sec=i[1])
-        gc.collect()
-        tf.keras.backend.clear_session()
-    return result
+        try:
+            segmentations.append(service(media, start_sec=i[0], stop_sec=i[1]))
+        except (MemoryError, tf.errors.ResourceExhaustedError):
+            service.release()
+            if not _split_core(core, pending):
+                raise
+            logging.warning(['ran out of memory; halving chunk', core])
+            continue
+        segmented_cores.append(core)
+    logging.info([
+        'segmented', media,
+        'model load', f'{service.load_time - load_time:.2f}s',
+        'inference', f'{service.inference_time - inference_time:.2f}s'])
+    service.after_media()
+    get_memory_profile().save()
+    return stitch_segmentations(segmentations, segmented_cores)
 
 
-def extract_music(
-        segmentation, segment_thres=EXTRACT_SEG_THRES,
-        segment_thres_final=EXTRACT_SEG_THRES_FINAL,
-        segment_connect=EXTRACT_SEG_CONNECT, start_padding=1, end_padding=4):
-    r = []
-    # bridges noEnergy segments that are likely fragmented
-    for i in range(len(segmentation)-2, 0, -1):
-        if segmentation[i][0] == 'noEnergy' and \
-                segmentation[i][2] - segmentation[i][1] < 4 and \
-                segmentation[i-1][0] == segmentation[i+1][0]:
-            segmentation[i-1] = (
-                segmentation[i-1][0],
-                segmentation[i-1][1],
-                segmentation[i+1][2])
-    for i in segmentation:
-        if i[0] == 'music' and i[2]-i[1] > segment_thres:
-            r.append(['', i[1] - start_padding, i[2] + end_padding])
-    for i in range(len(r)-1, 0, -1):
-        if r[i][1] - r[i-1][2] < segment_connect:
-            r[i-1][2] = r[i][2]
-            r[i][1] = r[i][2] + 1
-    rf = []
-    for i in r:
-        if i[1] < 5:
-            continue
-        if i[2]-i[1] > segment_thres_final:
-            rf.append(i)
-    return [['{}:{}:{}'.format(str(int(x[1]//3600)),
-                               str(int(x[1] % 3600 // 60)),
-                               str(int(x[1] % 60)).zfill(2)),
-             '{}:{}:{}'.format(str(int(x[2]//3600)),
-                               str(int(x[2] % 3600 // 60)),
-                               str(int(x[2] % 60)).zfill(2))] for x in rf]
+def _split_core(core: list, pending: list) -> bool:
+    '''pushes the two halves of core onto the pending stack, if it is long enough.'''
+    start = core[0] or 0
+    if core[1] is None or core[1] - start < 2 * SEGMENT_THRES_MIN:
+        return False
+    middle = (start + core[1]) // 2
+    pending.append([middle, core[1]])
+    pending.append([core[0], middle])
+    return True
 
 
 def extract_mah_stuff(
         media, segmented_stamps, outdir=None, rev=False,
-        delimited='/', timestamps=[], soundonly=True):
+        delimited='/', timestamps=[], soundonly=True,
+        save_config=SAVE_YAML_PATH, max_workers: int = None,
+        single_pass: bool = False, cut_mode: str = 'copy', source: str = None,
+        on_clip=None):
+    '''
+    cuts every segmented stamp out of media, at most max_workers ffmpeg at a
+    time (FFMPEG_WORKERS by default); returns the FFmpegResult of each clip.
+    single_pass: decode media once for all clips (cut_single_pass), falling
+    back to one ffmpeg per clip if that fails.
+    cut_mode: how video clips are stream copied, see utils.keyframes.CUT_MODES.
+    source: file the clips are cut from instead of media (e.g. its audio from
+    extract_audio); clips are still named after media.
+    on_clip: called with each clip's FFmpegResult as soon as it is cut.
+    '''
     nameswitch = False
     timestamps_ext = segmented_stamps
     try:
@@ -159,13 +500,14 @@ def extract_mah_stuff(
     except Exception:
         pass
     save_timestamps(mediab=os.path.basename(media),
-                    key='timestamps', val=timestamps_ext)
+                    key='timestamps', val=timestamps_ext, config=save_config)
     nameswitch = False
     file = media
+    source = source or media
     filename = file[:file.rfind('.')]
     fileext = file[len(filename):]
     filename = os.path.basename(filename)
-    cmds = []
+    cmds, outputs, ranges = [], [], []
     for i in range(len(timestamps_ext)):
         oud = outdir if outdir else os.path.dirname(file)
         encoding = ['-c:v', 'copy', '-c:a', 'copy']  # '-c:v copy -c:a copy'
@@ -174,6 +516,8 @@ def extract_mah_stuff(
             fileext = '.mp3'
         try:
             prefix = timestamps[i][1].zfill(2)
+            output = os.path.join(
+                oud, filename + f'_{str(i).zfill(2)}_{prefix}' + fileext)
             cmds.append([
                 'ffmpeg',
                 '-ss',
@@ -181,15 +525,13 @@ def extract_mah_stuff(
                 '-to',
                 timestamps_ext[i][1],
                 '-i',
-                file,
+                source,
                 '-reset_timestamps', '1',
-            ] + encoding + [
-                os.path.join(
-                    oud, filename + f'_{str(i).zfill(2)}_{prefix}' + fileext),
-
-            ] + encoding)
+            ] + encoding + [output] + encoding)
+            ranges.append([timestamps[i][0], timestamps_ext[i][1]])
         except Exception:
             prefix = str(i).zfill(2)
+            output = os.path.join(oud, filename + '_' + prefix + fileext)
             cmds.append([
                 'ffmpeg',
                 '-ss',
@@ -197,14 +539,102 @@ def extract_mah_stuff(
                 '-to',
                 timestamps_ext[i][1],
                 '-i',
-                "{}".format(file),
-            ] + encoding + [
-                "{}".format(os.path.join(
-                    oud, filename + '_' + prefix + fileext)),
-            ])
-    k = [Thread(target=ffmpeg, args=(x,)) for x in cmds]
-    for i in k:
-        i.start()
-    for i in k:
-        i.join()
-    # k[-1].join()
+                "{}".format(source),
+            ] + encoding + [output])
+            ranges.append(timestamps_ext[i])
+        outputs.append(output)
+    accurate = not soundonly and cut_mode != 'copy'
+    if (single_pass or accurate) and len(cmds) > 0:
+        try:
+            seconds = [[_stamp2sec(x[0]), _stamp2sec(x[1])] for x in ranges]
+        except ValueError:
+            logging.warning(['cannot cut', media, 'by seconds:', ranges])
+            single_pass = accurate = False
+    if single_pass and not accurate and len(cmds) > 0:
+        results = cut_single_pass(source, seconds, outputs, soundonly, max_workers)
+        if results is not None:
+            for result in results if on_clip is not None else []:
+                on_clip(result)
+            return results
+        logging.warning('single pass cutting failed; cutting clip by clip.')
+    if accurate and len(cmds) > 0:
+        index = get_keyframe_index(source)
+        return get_ffmpeg_executor(max_workers).run([
+            cut_cmd(source, index, start, stop, output, cut_mode)
+            for (start, stop), output in zip(seconds, outputs)], outputs,
+            stage='cut', media=media, on_done=on_clip)
+    return get_ffmpeg_executor(max_workers).run(
+        cmds, outputs, stage='cut', media=media, on_done=on_clip)
+
+
+def _stamp2sec(timestamp: str) -> float:
+    '''timestamp2sec, but keeps the fractions sec2timestamp writes.'''
+    seconds = 0.
+    for x in timestamp.split(':'):
+        seconds = seconds * 60 + float(x)
+    if not np.isfinite(seconds):
+        raise ValueError(timestamp)
+    return seconds
+
+
+def cut_single_pass(
+        media: str, ranges: list, outputs: list, soundonly: bool = True,
+        max_workers: int = None):
+    '''
+    cuts every [start_sec, stop_sec] range of media into its output with a
+    single ffmpeg decode: sound only clips are trimmed out of one split audio
+    stream, stream copied clips come from the segment muxer. returns one
+    FFmpegResult per clip, or None if the single pass did not work out.
+    '''
+    if soundonly:
+        graph = f'[0:a]asplit={len(ranges)}' + ''.join(
+            f'[s{i}]' for i in range(len(ranges)))
+        cmd = ['ffmpeg', '-y', '-i', media]
+        maps = []
+        for i, (start, stop) in enumerate(ranges):
+            graph += f';[s{i}]atrim=start={start}:end={stop},asetpts=PTS-STARTPTS[o{i}]'
+            maps += ['-map', f'[o{i}]', '-ab', '320k', outputs[i]]
+        cmd += ['-filter_complex', graph] + maps
+        result = get_ffmpeg_executor(max_workers).run(
+            [cmd], [media], stage='cut', media=media)[0]
+        if result.returncode != 0:
+            _remove_outputs(outputs)
+            return None
+        return [FFmpegResult(cmd, x, 0, result.elapsed) for x in outputs]
+    if any(x[1] <= x[0] for x in ranges) or \
+            any(y[0] < x[1] for x, y in zip(ranges, ranges[1:])):
+        logging.warning('overlapping clips cannot be cut by the segment muxer.')
+        return None
+    boundaries = sorted(set(x for clip in ranges for x in clip if x > 0))
+    ext = os.path.splitext(media)[1]
+    partdir = tempfile.mkdtemp(dir=os.path.dirname(outputs[0]) or None)
+    cmd = [
+        'ffmpeg', '-i', media, '-map', '0', '-c', 'copy',
+        '-f', 'segment', '-reset_timestamps', '1',
+        '-segment_times', ','.join(str(x) for x in boundaries),
+        os.path.join(partdir, f'part%04d{ext}')]
+    try:
+        result = get_ffmpeg_executor(max_workers).run(
+            [cmd], [media], stage='cut', media=media)[0]
+        if result.returncode != 0:
+            return None
+        # part k runs from boundaries[k - 1] to boundaries[k].
+        for (start, stop), output in zip(ranges, outputs):
+            part = boundaries.index(start) + 1 if start > 0 else 0
+            os.replace(os.path.join(partdir, f'part{part:04d}{ext}'), output)
+        return [FFmpegResult(cmd, x, 0, result.elapsed) for x in outputs]
+    except FileNotFoundError:
+        # the clip by clip fallback must not find the ones moved so far
+        _remove_outputs(outputs)
+        return None
+    finally:
+        shutil.rmtree(partdir, ignore_errors=True)
+
+
+def _remove_outputs(outputs: list) -> None:
+    '''removes the clips a failed single pass may have left behind.'''
+    for output in outputs:
+        try:
+            os.remove(output)
+        except FileNotFoundError:
+            pass
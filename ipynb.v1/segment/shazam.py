@@ -3,16 +3,84 @@ import glob
 import logging
 import shutil
 import regex
-import time
-import requests
 import asyncio
+import multiprocessing
+from array import array
+from concurrent.futures import ProcessPoolExecutor
 from shazamio import Shazam
 
 from utils.logging import save_timestamps
+from network.ratelimit import AsyncTokenBucket, is_rate_limited
+from network.coverart import CoverArtFetcher
+from segment.shazamcache import ShazamCache
+from segment.fingerprint import FingerprintIndex
+from utils.ffmpeg import media_info, wav_window, pcm_window
 
+# 识曲请求速率（每秒），原来每次请求后固定等 3 秒
+SHAZAM_RPS = 1.
+# 允许的突发请求数
+SHAZAM_BURST = 3
+# 同时进行的识曲请求数，也是生成指纹的进程数（--shazam_multithread）
+SHAZAM_CONCURRENCY = 3
+# 被限流后的最多重试次数
+SHAZAM_RETRIES = 5
+# 抽样识曲：在片段的这些位置各取一个窗口（先试中间）
+SHAZAM_SAMPLE_POSITIONS = (0.5, 0.3, 0.7)
+SHAZAM_SAMPLE_WINDOW = 12
+# 匹配的时间/频率偏移都小于此值时视为可信，直接采用
+SHAZAM_SAMPLE_SKEW = 0.01
 
-semaphore = asyncio.Semaphore(3)
-myshazam = Shazam()
+limiter = AsyncTokenBucket(SHAZAM_RPS, SHAZAM_BURST, SHAZAM_CONCURRENCY)
+_shazam = None
+_coverart_fetcher = None
+_signature_pool = None
+_signature_workers = SHAZAM_CONCURRENCY
+
+
+def get_shazam() -> Shazam:
+    global _shazam
+    if _shazam is None:
+        _shazam = Shazam()
+    return _shazam
+
+
+def set_recognizer(recognizer) -> None:
+    '''
+    replaces the Shazam client every request goes through; recognizer needs
+    an async recognize(data) (and send_recognize_request(signature) to take
+    signatures), e.g. benchmark.shazam.FakeRecognizer. None restores Shazam.
+    '''
+    global _shazam
+    _shazam = recognizer
+
+
+def get_signature_pool() -> ProcessPoolExecutor:
+    global _signature_pool
+    if _signature_pool is None:
+        _signature_pool = ProcessPoolExecutor(
+            max_workers=_signature_workers,
+            mp_context=multiprocessing.get_context('spawn'))
+    return _signature_pool
+
+
+def configure_shazam(
+        concurrency: int = None, rps: float = None) -> None:
+    '''
+    concurrency: requests in flight and signature worker processes.
+    rps: requests per second, 0 for no limit.
+    '''
+    global _signature_workers
+    limiter.configure(rps=rps, concurrency=concurrency)
+    if concurrency is not None and concurrency != _signature_workers:
+        shutdown_shazam()
+        _signature_workers = concurrency
+
+
+def shutdown_shazam() -> None:
+    global _signature_pool
+    if _signature_pool is not None:
+        _signature_pool.shutdown()
+        _signature_pool = None
 
 
 async def shazam_orig(file, **kwargs):
@@ -22,7 +90,8 @@ async def shazam_orig(file, **kwargs):
 
 async def shazaming(
     outdir, media, shazam_coverart_path='',
-    shazam_func=shazam_orig, ignore_fails=False
+    shazam_func=shazam_orig, ignore_fails=False, cache: ShazamCache = None,
+    index: FingerprintIndex = None
 ):
     mediab = os.path.basename(media)
     files = glob.glob(os.path.join(
@@ -30,8 +99,58 @@ async def shazaming(
     ))
     await asyncio.gather(*[shazam_threaded(
         file, shazam_coverart_path=shazam_coverart_path,
-        shazam_func=shazam_func, ignore_fails=ignore_fails
+        shazam_func=shazam_func, ignore_fails=ignore_fails, cache=cache,
+        index=index
     ) for file in files])
+    await _shazamed(outdir, mediab, cache)
+
+
+async def shazam_pipeline(
+    outdir, media, cut, shazam_coverart_path='',
+    shazam_func=shazam_orig, ignore_fails=False, cache: ShazamCache = None,
+    index: FingerprintIndex = None, consumers: int = None
+):
+    '''
+    runs cut(on_clip) (e.g. segment_media) on a thread and recognizes every
+    clip as soon as its ffmpeg exits, so recognition overlaps the cutting of
+    the clips after it. on_clip takes the clip's FFmpegResult.
+    '''
+    loop = asyncio.get_running_loop()
+    queue = asyncio.Queue()
+
+    def on_clip(result):
+        if result.returncode == 0:
+            loop.call_soon_threadsafe(queue.put_nowait, result.name)
+
+    async def consume():
+        while True:
+            file = await queue.get()
+            if file is None:
+                return
+            await shazam_threaded(
+                file, shazam_coverart_path=shazam_coverart_path,
+                shazam_func=shazam_func, ignore_fails=ignore_fails, cache=cache,
+                index=index)
+
+    workers = [
+        asyncio.ensure_future(consume())
+        for _ in range(consumers or limiter.concurrency or SHAZAM_CONCURRENCY)]
+    try:
+        await asyncio.to_thread(cut, on_clip)
+    finally:
+        # clips queued by the cutting thread are already ahead of these
+        for _ in workers:
+            queue.put_nowait(None)
+        await asyncio.gather(*workers)
+    await _shazamed(outdir, os.path.basename(media), cache)
+
+
+async def _shazamed(outdir, mediab, cache: ShazamCache = None):
+    if cache is not None:
+        cache.log_stats()
+    if _coverart_fetcher is not None:
+        # its session belongs to this event loop
+        await _coverart_fetcher.close()
     save_timestamps(mediab=mediab,
                     key='shazam', val=[
                         os.path.basename(x)
@@ -44,8 +163,13 @@ async def shazaming(
 
 async def shazam_threaded(
     file, shazam_coverart_path='',
-    shazam_func=shazam_orig, ignore_fails=True
+    shazam_func=shazam_orig, ignore_fails=True, cache: ShazamCache = None,
+    index: FingerprintIndex = None
 ):
+    '''
+    names file after its track: from cache, then from the local fingerprint
+    index, and only then from shazam_func.
+    '''
     results = {}
     if ' by ' in file:
         return
@@ -56,7 +180,28 @@ async def shazam_threaded(
     try:
         # match = shazam(file, stop_at_first_match = 1)[-1]
         # results[fn] = shazam_title(match)
-        results[fn], match = await shazam_func(file)
+        match, key = None, None
+        if cache is not None:
+            try:
+                key = await asyncio.to_thread(cache.key, file)
+                match = cache.get(key)
+            except Exception:
+                logging.warning([fn, 'could not be looked up in the shazam cache'])
+        found = 'shazam cache'
+        if match is None and index is not None:
+            try:
+                match = await asyncio.to_thread(index.match, file)
+                found = 'fingerprint index'
+            except Exception:
+                logging.warning([fn, 'could not be matched locally'])
+        if match is not None:
+            logging.info([fn, 'found in the', found])
+            results[fn] = shazam_title(match)
+        else:
+            results[fn], match = await shazam_func(file)
+            if key is not None:
+                cache.put(key, match)
+            found = 'shazam'
         try:
             logging.info([fn, 'shazam found to be', results[fn]])
         except UnicodeEncodeError:
@@ -68,8 +213,14 @@ async def shazam_threaded(
             (fn + f"_{results[fn][0].replace(':', ' ')} by {results[fn][1].replace(r'/', '')}") + fileext
         )
         shutil.move(file, renamed_file)
+        if index is not None and found == 'shazam':
+            # a fresh remote match; teach the local index
+            try:
+                await asyncio.to_thread(index.add, renamed_file, match)
+            except Exception:
+                logging.warning([fn, 'could not be fingerprinted'])
         if os.path.isdir(shazam_coverart_path):
-            shazam_coverart(match, renamed_file, shazam_coverart_path)
+            await shazam_coverart(match, renamed_file, shazam_coverart_path)
     except (IndexError, KeyError):
         logging.error([fn, 'shazam failed'])
     except Exception:
@@ -77,11 +228,117 @@ async def shazam_threaded(
             raise
 
 
+async def shazam_sampled(file, **kwargs):
+    '''
+    recognizes SHAZAM_SAMPLE_WINDOW seconds windows decoded from inside file
+    (at SHAZAM_SAMPLE_POSITIONS) instead of the whole clip; stops at the
+    first confident match or when two windows agree, else takes the track
+    most windows matched.
+    '''
+    # ffprobe blocks; keep it off the event loop
+    duration = (await asyncio.to_thread(media_info, file)).duration
+    if duration <= SHAZAM_SAMPLE_WINDOW:
+        offsets = [0.]
+    else:
+        offsets = [
+            min(max(0., duration * x - SHAZAM_SAMPLE_WINDOW / 2),
+                duration - SHAZAM_SAMPLE_WINDOW)
+            for x in SHAZAM_SAMPLE_POSITIONS]
+    votes = {}
+    for offset in offsets:
+        match = await recognize_file(file, offset, SHAZAM_SAMPLE_WINDOW)
+        track = match.get('track')
+        if not track:
+            continue
+        key = track.get('key') or (track.get('title'), track.get('subtitle'))
+        count, _ = votes.get(key, (0, track))
+        votes[key] = (count + 1, track)
+        if count + 1 >= 2 or _confident(match):
+            return shazam_title(track), track
+    if len(votes) == 0:
+        raise KeyError('no sampled window matched')
+    # dicts keep insertion order, so ties go to the earliest window
+    count, track = max(votes.values(), key=lambda x: x[0])
+    return shazam_title(track), track
+
+
+def _confident(match) -> bool:
+    return any(
+        abs(x.get('timeskew', 1)) <= SHAZAM_SAMPLE_SKEW and
+        abs(x.get('frequencyskew', 1)) <= SHAZAM_SAMPLE_SKEW
+        for x in match.get('matches', [])[:1])
+
+
 async def shazam(mp3):
-    async with semaphore:
-        match = await myshazam.recognize(mp3)
-        time.sleep(3)
-        return match['track']
+    return (await recognize_file(mp3))['track']
+
+
+def file_signature(file: str, offset: float = None,
+                   window: float = SHAZAM_SAMPLE_WINDOW):
+    '''
+    decodes window seconds of file (the middle by default) and builds its
+    shazam signature; runs on the signature pool. None if shazamio's python
+    signature generator is unavailable or the audio is too short.
+    '''
+    try:
+        from shazamio.algorithm import SignatureGenerator
+    except ImportError:
+        return None
+    if offset is None:
+        offset = max(0., media_info(file).duration / 2 - window / 2)
+    generator = SignatureGenerator()
+    generator.MAX_TIME_SECONDS = window
+    generator.feed_input(array('h', pcm_window(file, offset, window)).tolist())
+    return generator.get_next_signature()
+
+
+async def recognize_file(file: str, offset: float = None,
+                         window: float = SHAZAM_SAMPLE_WINDOW):
+    '''
+    recognizes window seconds of file at offset (the whole file when offset
+    is None, as shazam itself picks its middle). the signature is built on
+    the signature pool so the event loop keeps sending other requests; falls
+    back to Shazam.recognize when that does not work with this shazamio.
+    '''
+    try:
+        signature = await asyncio.get_running_loop().run_in_executor(
+            get_signature_pool(), file_signature, file, offset, window)
+    except Exception as e:
+        logging.debug([file, 'signature generation failed:', e])
+        signature = None
+    if signature is not None:
+        try:
+            return await _request(
+                lambda x: x.send_recognize_request(signature))
+        except (AttributeError, TypeError) as e:
+            logging.debug(['signature request failed:', e])
+    if offset is not None:
+        file = await asyncio.to_thread(wav_window, file, offset, window)
+    return await recognize(file)
+
+
+async def recognize(data):
+    '''Shazam.recognize on a path or audio bytes, rate limited and retried.'''
+    return await _request(lambda x: x.recognize(data))
+
+
+async def _request(request):
+    '''awaits request(shazam) under the rate limiter, backing off when limited.'''
+    for attempt in range(SHAZAM_RETRIES + 1):
+        async with limiter:
+            try:
+                match = await request(get_shazam())
+            except Exception as e:
+                if not is_rate_limited(e) or attempt == SHAZAM_RETRIES:
+                    raise
+                limiter.backoff(attempt)
+                continue
+        if 'track' not in match and 'retryms' in match and \
+                attempt < SHAZAM_RETRIES:
+            # shazam asks to come back later instead of answering
+            limiter.backoff(attempt, match['retryms'] / 1000)
+            continue
+        return match
 
 
 def legalize_filename(fn):
@@ -118,17 +375,22 @@ def shazam_title(match):
     ]
 
 
-def shazam_coverart(match, fn, outdir):
+async def shazam_coverart(match, fn, outdir):
     try:
         albumart = match['images']['coverarthq']
-        req = requests.get(albumart)
-        with open(os.path.join(
+        await get_coverart_fetcher().save(albumart, os.path.join(
             outdir, os.path.basename(fn) + albumart[albumart.rfind('.'):]
-        ), 'wb') as f:
-            f.write(req.content)
+        ))
     except Exception:
         pass
 
 
+def get_coverart_fetcher() -> CoverArtFetcher:
+    global _coverart_fetcher
+    if _coverart_fetcher is None:
+        _coverart_fetcher = CoverArtFetcher()
+    return _coverart_fetcher
+
+
 class KoreanCharException(BaseException):
     pass
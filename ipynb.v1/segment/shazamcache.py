@@ -0,0 +1,112 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import sqlite3
+import threading
+
+from utils.ffmpeg import media_info, pcm_window
+from utils.paths import CACHE_DIR
+
+
+SHAZAM_CACHE_PATH = os.path.join(CACHE_DIR, 'shazam.sqlite')
+# 识曲结果保留天数
+SHAZAM_CACHE_TTL = 90
+# 最多保留的识曲结果条数，超出后淘汰最久未命中的
+SHAZAM_CACHE_ENTRIES = 20000
+# 参与哈希的解码窗口：片段中间的这么多秒（shazam 也只听 12 秒左右）
+SHAZAM_CACHE_WINDOW = 12
+SHAZAM_CACHE_SAMPLE_RATE = 16000
+
+
+def audio_window(file: str, window: float = SHAZAM_CACHE_WINDOW,
+                 sample_rate: int = SHAZAM_CACHE_SAMPLE_RATE) -> bytes:
+    '''mono s16le PCM of window seconds in the middle of file.'''
+    offset = max(0., media_info(file).duration / 2 - window / 2)
+    return pcm_window(file, offset, window, sample_rate)
+
+
+class ShazamCache():
+    '''
+    sqlite cache of shazam track payloads, keyed by a hash of the clip's
+    decoded audio window so renamed or re-cut identical clips hit too.
+    entries expire after ttl days; past max_entries the least recently hit
+    ones are evicted. hits and misses are counted across runs.
+    '''
+
+    def __init__(
+        self,
+        path: str = SHAZAM_CACHE_PATH,
+        ttl: float = SHAZAM_CACHE_TTL,
+        max_entries: int = SHAZAM_CACHE_ENTRIES,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.lock = threading.Lock()
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.db:
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS tracks ('
+                'key TEXT PRIMARY KEY, track TEXT, created REAL, accessed REAL)')
+            self.db.execute(
+                'CREATE TABLE IF NOT EXISTS stats (name TEXT PRIMARY KEY, value INTEGER)')
+
+    def key(self, file: str) -> str:
+        return hashlib.sha1(audio_window(file)).hexdigest()
+
+    def _count(self, name: str) -> None:
+        self.db.execute(
+            'INSERT INTO stats VALUES (?, 1) '
+            'ON CONFLICT(name) DO UPDATE SET value = value + 1', (name,))
+
+    def get(self, key: str):
+        now = time.time()
+        with self.lock, self.db:
+            row = self.db.execute(
+                'SELECT track FROM tracks WHERE key = ? AND created > ?',
+                (key, now - self.ttl * 86400)).fetchone()
+            self._count('hits' if row else 'misses')
+            if row is None:
+                return None
+            self.db.execute(
+                'UPDATE tracks SET accessed = ? WHERE key = ?', (now, key))
+        return json.loads(row[0])
+
+    def put(self, key: str, track: dict) -> None:
+        now = time.time()
+        with self.lock, self.db:
+            self.db.execute(
+                'INSERT OR REPLACE INTO tracks VALUES (?, ?, ?, ?)',
+                (key, json.dumps(track, ensure_ascii=False), now, now))
+        self.evict()
+
+    def evict(self) -> None:
+        with self.lock, self.db:
+            self.db.execute(
+                'DELETE FROM tracks WHERE created <= ?',
+                (time.time() - self.ttl * 86400,))
+            self.db.execute(
+                'DELETE FROM tracks WHERE key IN (SELECT key FROM tracks '
+                'ORDER BY accessed DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def stats(self) -> dict:
+        with self.lock:
+            counts = dict(self.db.execute('SELECT name, value FROM stats'))
+            entries = self.db.execute('SELECT COUNT(*) FROM tracks').fetchone()[0]
+        hits, misses = counts.get('hits', 0), counts.get('misses', 0)
+        return {
+            'entries': entries, 'hits': hits, 'misses': misses,
+            'hit_rate': hits / (hits + misses) if hits + misses else 0.,
+        }
+
+    def log_stats(self) -> None:
+        stats = self.stats()
+        logging.info([
+            'shazam cache', stats['entries'], 'entries;', stats['hits'], 'hits',
+            stats['misses'], 'misses', f"({stats['hit_rate']:.1%} hit rate)"])
+
+    def close(self) -> None:
+        self.db.close()
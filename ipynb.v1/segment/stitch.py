@@ -0,0 +1,55 @@
+import numpy as np
+
+# 拼接分段结果时，同标签片段间隔小于此值（秒）则合并
+STITCH_TOLERANCE = 0.1
+
+
+def pad_segment_ranges(ranges: list, overlap: int = 0) -> list:
+    '''widens [start_sec, stop_sec] chunks by overlap seconds on both sides.'''
+    return [[
+        None if x[0] is None else max(0, x[0] - overlap),
+        None if x[1] is None else x[1] + overlap] for x in ranges]
+
+
+def stitch_segmentations(
+        segmentations: list, cores: list,
+        tolerance: float = STITCH_TOLERANCE) -> list:
+    '''
+    segmentations[i] was computed over a window around cores[i]
+    ([start_sec, stop_sec], None for an open end). every segmentation is
+    clipped to its core, and label runs that meet across a core boundary
+    are merged, so a song crossing a chunk boundary stays one music run.
+    '''
+    result = []
+    for segmentation, (core_start, core_stop) in zip(segmentations, cores):
+        for label, start, stop in segmentation:
+            if core_start is not None:
+                start = max(start, core_start)
+            if core_stop is not None:
+                stop = min(stop, core_stop)
+            if stop <= start:
+                continue
+            if len(result) > 0 and result[-1][0] == label and \
+                    start - result[-1][2] <= tolerance:
+                result[-1] = (label, result[-1][1], max(stop, result[-1][2]))
+            else:
+                result.append((label, start, stop))
+    return result
+
+
+def segmentation_agreement(
+        segmentation_a: list, segmentation_b: list, step: float = 0.1) -> float:
+    '''fraction of the timeline (sampled every step seconds) labelled alike.'''
+    def labels_at(segmentation, times):
+        if len(segmentation) == 0:
+            return np.full(len(times), '', dtype=object)
+        starts = np.array([x[1] for x in segmentation])
+        stops = np.array([x[2] for x in segmentation])
+        labels = np.array([x[0] for x in segmentation], dtype=object)
+        index = np.clip(np.searchsorted(starts, times, side='right') - 1, 0, None)
+        return np.where(times < stops[index], labels[index], '')
+    end = max([x[2] for x in segmentation_a + segmentation_b] + [0])
+    if end == 0:
+        return 1.
+    times = np.arange(0, end, step)
+    return float(np.mean(labels_at(segmentation_a, times) == labels_at(segmentation_b, times)))
@@ -0,0 +1,80 @@
+'''
+extract_music must match extract_music_reference on any segmentation.
+
+python -m pytest tests
+'''
+import random
+from copy import deepcopy
+
+import pytest
+
+from segment.music import extract_music, extract_music_reference, \
+    segmentation_to_arrays
+
+LABELS = ['music', 'speech', 'noise', 'noEnergy']
+FUZZ_CASES = 5000
+
+
+def random_segmentation(rng: random.Random, count: int) -> list:
+    '''count contiguous runs; short noEnergy gaps, often in chains.'''
+    r, t = [], rng.uniform(0, 30)
+    while len(r) < count:
+        if r and rng.random() < 0.3:
+            # a chain of short noEnergy gaps between runs of one label
+            label = rng.choice(LABELS[:3])
+            for _ in range(rng.randint(1, 4)):
+                if len(r) >= count:
+                    break
+                gap = rng.uniform(0.1, 5)
+                r.append(('noEnergy', t, t + gap))
+                t += gap
+                if rng.random() < 0.2 and len(r) < count:
+                    # chunk seams leave noEnergy runs back to back
+                    r.append(('noEnergy', t, t + 0.5))
+                    t += 0.5
+                length = rng.uniform(1, 200)
+                r.append((label, t, t + length))
+                t += length
+            continue
+        label = rng.choice(LABELS)
+        length = rng.uniform(0.1, 5) if label == 'noEnergy' else \
+            rng.choice([rng.uniform(1, 30), rng.uniform(30, 300)])
+        r.append((label, t, t + length))
+        t += length
+    return r[:count]
+
+
+def check(segmentation: list, **kwargs) -> None:
+    expected = extract_music_reference(deepcopy(segmentation), **kwargs)
+    given = deepcopy(segmentation)
+    assert extract_music(segmentation, **kwargs) == expected
+    assert segmentation == given, 'extract_music mutated its input'
+    assert extract_music(segmentation_to_arrays(segmentation), **kwargs) == expected
+
+
+@pytest.mark.parametrize('segmentation', [
+    [],
+    [('music', 10, 200)],
+    [('speech', 0, 10)],
+    [('music', 10, 100), ('music', 101, 300)],
+    [('music', 10, 100), ('noEnergy', 100, 102)],
+    [('music', 10, 100), ('noEnergy', 100, 102), ('music', 102, 200)],
+    [('music', 10, 50), ('noEnergy', 50, 52), ('music', 52, 90),
+     ('noEnergy', 90, 91), ('music', 91, 150), ('noEnergy', 150, 153),
+     ('music', 153, 200)],
+    [('music', 10, 50), ('noEnergy', 50, 51), ('noEnergy', 51, 52),
+     ('noEnergy', 52, 53), ('music', 53, 200)],
+])
+def test_edge_cases(segmentation):
+    check(segmentation)
+
+
+def test_randomized():
+    rng = random.Random(0)
+    for _ in range(FUZZ_CASES):
+        segmentation = random_segmentation(rng, rng.randint(0, 40))
+        check(
+            segmentation,
+            segment_thres=rng.choice([20, 60]),
+            segment_thres_final=rng.choice([40, 80]),
+            segment_connect=rng.choice([0, 5, 30]))
@@ -0,0 +1,53 @@
+'''
+rate limit detection and backoff of network.ratelimit.
+
+python -m pytest tests
+'''
+import asyncio
+import time
+
+from network.ratelimit import AsyncTokenBucket, is_rate_limited
+
+
+class ContentTypeError(Exception):
+    '''shaped like aiohttp.ContentTypeError: the response status rides along.'''
+
+    def __init__(self, status: int):
+        super().__init__('Attempt to decode JSON with unexpected mimetype: text/html')
+        self.status = status
+
+
+class FailedDecodeJson(Exception):
+    '''shaped like shazamio.exceptions.FailedDecodeJson.'''
+
+
+def shazamio_error(status: int) -> Exception:
+    # what shazamio raises when shazam answers with a non-json error page
+    try:
+        try:
+            raise ContentTypeError(status)
+        except ContentTypeError as e:
+            raise FailedDecodeJson('Failed to decode json') from e
+    except FailedDecodeJson as e:
+        return e
+
+
+def test_shazamio_429_is_rate_limited():
+    assert is_rate_limited(shazamio_error(429))
+    assert not is_rate_limited(shazamio_error(500))
+
+
+def test_direct_errors():
+    assert is_rate_limited(ContentTypeError(429))
+    assert is_rate_limited(RuntimeError('429 Too Many Requests'))
+    assert not is_rate_limited(RuntimeError('fake recognizer failure'))
+
+
+def test_backoff_pauses_without_rps():
+    async def main():
+        limiter = AsyncTokenBucket(0)
+        limiter.backoff(retry_after=0.2)
+        start = time.monotonic()
+        async with limiter:
+            return time.monotonic() - start
+    assert asyncio.run(main()) >= 0.19
@@ -0,0 +1,113 @@
+'''
+chunked segmentation stitched back together must match one unchunked pass.
+
+python -m pytest tests
+'''
+import random
+
+import pytest
+
+from segment.stitch import pad_segment_ranges, stitch_segmentations, \
+    segmentation_agreement
+
+LABELS = ['music', 'speech', 'noise', 'noEnergy']
+# chunk boundaries may move by this much (seconds) between chunks
+JITTER = 0.05
+FUZZ_CASES = 500
+
+
+def random_truth(rng: random.Random, duration: float) -> list:
+    '''contiguous runs over [0, duration], no two neighbours alike.'''
+    r, t, label = [], 0., None
+    while t < duration:
+        label = rng.choice([x for x in LABELS if x != label])
+        stop = min(duration, t + rng.uniform(0.5, 150))
+        r.append((label, t, stop))
+        t = stop
+    return r
+
+
+def segment_window(
+        rng: random.Random, truth: list, start: float, stop: float,
+        duration: float, edge: float) -> list:
+    '''
+    what the segmenter would return for the window start:stop of truth:
+    boundaries jittered a little, and the outer edge seconds next to a cut
+    (no context there) mislabelled.
+    '''
+    start = 0. if start is None else start
+    stop = duration if stop is None else stop
+    r = []
+    for label, a, b in truth:
+        a, b = max(a, start), min(b, stop)
+        if b > a:
+            r.append([label, a, b])
+    for x, y in zip(r, r[1:]):
+        # a boundary moves as one, so runs stay contiguous
+        x[2] = y[1] = x[2] + rng.uniform(-JITTER, JITTER)
+    if start > 0:
+        r = [['noise', start, start + edge]] + \
+            [[x, max(a, start + edge), b] for x, a, b in r if b > start + edge]
+    if stop < duration:
+        r = [[x, a, min(b, stop - edge)] for x, a, b in r if a < stop - edge] + \
+            [['noise', stop - edge, stop]]
+    return [tuple(x) for x in r]
+
+
+def chunked(rng, truth, duration, chunk, overlap):
+    cores = [[x, x + chunk] for x in range(0, int(duration), chunk)]
+    cores[0][0] = None
+    cores[-1][1] = None
+    segmentations = [
+        segment_window(rng, truth, start, stop, duration, overlap / 2)
+        for start, stop in pad_segment_ranges(cores, overlap)]
+    return stitch_segmentations(segmentations, cores)
+
+
+def without_slivers(segmentation: list) -> list:
+    '''
+    drops runs under 2 * JITTER seconds and merges the neighbours they
+    separated: where two chunks disagree on a boundary that sits right on
+    their seam, a sliver is the expected (and tolerated) result.
+    '''
+    r = []
+    for label, start, stop in segmentation:
+        if stop - start < 2 * JITTER:
+            continue
+        if r and r[-1][0] == label:
+            r[-1] = (label, r[-1][1], stop)
+        else:
+            r.append((label, start, stop))
+    return r
+
+
+def assert_matches(stitched: list, truth: list) -> None:
+    assert segmentation_agreement(stitched, truth) > 0.99
+    stitched = without_slivers(stitched)
+    assert [x[0] for x in stitched] == [x[0] for x in truth]
+    for x, y in zip(stitched, truth):
+        assert x[1] == pytest.approx(y[1], abs=2 * JITTER)
+        assert x[2] == pytest.approx(y[2], abs=2 * JITTER)
+
+
+def test_song_across_a_boundary():
+    truth = [('speech', 0, 250), ('music', 250, 380), ('speech', 380, 600)]
+    cores = [[None, 300], [300, None]]
+    segmentations = [
+        [('speech', 0, 250), ('music', 250, 320)],
+        [('noise', 280, 285), ('music', 285, 380), ('speech', 380, 600)],
+    ]
+    stitched = stitch_segmentations(segmentations, cores)
+    assert stitched == truth
+    assert pad_segment_ranges(cores, 20) == [[None, 320], [280, None]]
+
+
+def test_randomized():
+    rng = random.Random(0)
+    for _ in range(FUZZ_CASES):
+        duration = rng.uniform(100, 3000)
+        truth = random_truth(rng, duration)
+        stitched = chunked(
+            rng, truth, duration, rng.choice([60, 120, 800]),
+            rng.choice([0, 10, 20]))
+        assert_matches(stitched, truth)
@@ -1,96 +1,377 @@
 
+import io
 import os
+import json
+import wave
 import subprocess
 import tempfile
-from threading import Thread
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor, Future, as_completed
 import logging
 
 import math
+import numpy as np
 
-from utils.timestamp import timestamp2sec, sec2timestamp
-
-def get_length(filename):
-    if not filename:
-        return "0"
-    result = subprocess.run(
-        [
-            "ffprobe",
-            "-v",
-            "error",
-            '-sexagesimal',
-            "-show_entries",
-            "format=duration",
-            "-of",
-            "default=noprint_wrappers=1:nokey=1",
-            filename
-        ],
-        stdout=subprocess.PIPE,
-        stderr=subprocess.STDOUT)
-    return str(result.stdout)[2:-5] #float() without -sexagesimal
-
-def get_length_using_copied_audio(filename: str):
-    temp_audio_file = os.path.join(
-            tempfile.gettempdir(),
-            'get_length_acodec_temp.mp4'
-        )
+from utils.timestamp import sec2timestamp
+from utils.memory import SEGMENT_THRES_AUTO, SEGMENT_THRES_MIN, auto_segment_length
+from utils.metrics import FFmpegMetrics, record_ffmpeg
+
+# 同时运行的 ffmpeg 进程数上限，默认为 CPU 核数
+FFMPEG_WORKERS = os.cpu_count() or 1
+
+class MediaInfo():
+    '''duration (seconds, float) and streams of a media, from one ffprobe call.'''
+
+    def __init__(self, filename: str, duration: float, streams: list):
+        self.filename = filename
+        self.duration = duration
+        self.streams = streams
+
+    @classmethod
+    def probe(cls, filename: str):
+        result = subprocess.run([
+            'ffprobe', '-v', 'error', '-of', 'json',
+            '-show_entries',
+            'format=duration:stream=index,codec_type,codec_name,duration'
+            ':stream_disposition=attached_pic',
+            filename],
+            stdout=subprocess.PIPE, text=True)
+        try:
+            probed = json.loads(result.stdout or '{}')
+        except ValueError:
+            probed = {}
+        streams = probed.get('streams', [])
+        duration = _float(probed.get('format', {}).get('duration'))
+        if not duration:
+            duration = max(
+                [_float(x.get('duration')) for x in streams] + [0.])
+        if not duration:
+            # happens with DDrecorder's raw streams.
+            logging.warning(
+                f'ffprobe on {filename} length failed. now scanning its audio packets.')
+            duration = _packet_duration(filename)
+        return cls(filename, duration, streams)
+
+    def codecs(self, codec_type: str) -> list:
+        return [x.get('codec_name') for x in self.streams
+                if x.get('codec_type') == codec_type and
+                not x.get('disposition', {}).get('attached_pic')]
+
+    @property
+    def has_video(self) -> bool:
+        '''has a video stream that is not just cover art.'''
+        return len(self.codecs('video')) > 0
+
+    @property
+    def has_audio(self) -> bool:
+        return len(self.codecs('audio')) > 0
+
+    @property
+    def video_codec(self):
+        return (self.codecs('video') or [None])[0]
+
+    @property
+    def audio_codec(self):
+        return (self.codecs('audio') or [None])[0]
+
+def _float(value) -> float:
     try:
-        os.remove(temp_audio_file)
-    except OSError:
-        pass
-    subprocess.call([
-        'ffmpeg',
-        '-i',
-        filename,
-        '-reset_timestamps',
-        '1',
-        '-vn',
-        '-acodec',
-        'copy',
-        temp_audio_file,
-        ])
-    result = get_length(temp_audio_file)
-    os.remove(temp_audio_file)
-    return result
-
-def split_in_half(filename, ):
-    length = timestamp2sec(get_length(filename))/2
-    cmds = [
-        'ffmpeg -i "{}" {} -c:v copy -c:a copy "{}"'.format(
-            filename, 
-            '-to {}'.format(str(length)),
-            filename[:filename.rfind('.')] + "_a" + filename[filename.rfind('.'):]),
-        'ffmpeg -i "{}" {} -c:v copy -c:a copy "{}"'.format(
-            filename, 
-            '-ss {} '.format(str(length)),
-            filename[:filename.rfind('.')] + "_b" + filename[filename.rfind('.'):]),
-        
-            ]
-    k = [Thread(target=ffmpeg, args=(x,)) for x in cmds]
-    for i in k:
-        i.start()
-    k[-1].join()
-    os.remove(filename)
-
-def ffmpeg(cmd, wait = True):
+        return float(value)
+    except (TypeError, ValueError):
+        return 0.
+
+def _packet_duration(filename: str) -> float:
+    '''end of the last audio packet, read without writing anything to disk.'''
+    process = subprocess.Popen([
+        'ffprobe', '-v', 'error', '-select_streams', 'a:0',
+        '-show_entries', 'packet=pts_time,duration_time', '-of', 'csv=p=0',
+        filename],
+        stdout=subprocess.PIPE, text=True)
+    end = 0.
+    for line in process.stdout:
+        fields = line.strip().split(',')
+        end = max(end, _float(fields[0]) + (_float(fields[1]) if len(fields) > 1 else 0.))
+    process.wait()
+    return end
+
+_media_infos = {}
+
+def media_info(filename: str) -> MediaInfo:
+    '''
+    MediaInfo of filename, memoized per (path, size, mtime); urls and other
+    inputs that are not local files are probed every time.
+    '''
+    if not os.path.isfile(filename):
+        return MediaInfo.probe(filename)
+    stat = os.stat(filename)
+    key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns)
+    if key not in _media_infos:
+        _media_infos[key] = MediaInfo.probe(filename)
+    return _media_infos[key]
+
+def split_into(
+        filename: str, n: int = None, max_length: float = None,
+        max_workers: int = None, remove: bool = True):
+    '''
+    stream copies filename into n parts (or as many as keep each part under
+    max_length seconds) in parallel; video is split on keyframes. parts are
+    named filename_a, filename_b, ... (filename_00, ... past 26 parts).
+    returns [(part path, offset seconds), ...] and removes filename once every
+    part succeeded; returns None and keeps filename otherwise.
+    '''
+    info = media_info(filename)
+    if n is None:
+        n = max(1, math.ceil(info.duration / max_length))
+    boundaries = [info.duration * i / n for i in range(n)]
+    if info.has_video:
+        from utils.keyframes import get_keyframe_index
+        index = get_keyframe_index(filename)
+        if index.keyframes:
+            boundaries = sorted(set(index.nearest(x) for x in boundaries))
+    base, ext = os.path.splitext(filename)
+    cmds, parts = [], []
+    for i, start in enumerate(boundaries):
+        suffix = chr(ord('a') + i) if len(boundaries) <= 26 else str(i).zfill(2)
+        part = f'{base}_{suffix}{ext}'
+        cmd = ['ffmpeg', '-y', '-ss', str(start), '-i', filename]
+        if i + 1 < len(boundaries):
+            cmd += ['-t', str(boundaries[i + 1] - start)]
+        cmds.append(cmd + [
+            '-map', '0', '-c', 'copy', '-avoid_negative_ts', 'make_zero', part])
+        parts.append((part, start))
+    results = get_ffmpeg_executor(max_workers).run(
+        cmds, stage='split', media=filename)
+    if any(x.returncode != 0 for x in results):
+        logging.error((filename, 'split failed; keeping the original.'))
+        for part, _ in parts:
+            if os.path.isfile(part):
+                os.remove(part)
+        return None
+    if remove:
+        os.remove(filename)
+    return parts
+
+def split_in_half(filename, max_workers: int = None):
+    return split_into(filename, 2, max_workers=max_workers)
+
+def extract_audio(filename: str, outdir: str = None):
+    '''
+    stream copies the first audio stream of filename into a uniquely named
+    scratch .mka in outdir (the temp dir by default), so later cuts and probes
+    skip the video. returns its path, or None if that failed.
+    '''
+    fd, output = tempfile.mkstemp(
+        suffix='.audio.mka',
+        prefix=os.path.splitext(os.path.basename(filename))[0] + '.',
+        dir=outdir)
+    os.close(fd)
+    start = time.perf_counter()
+    returncode = ffmpeg([
+        'ffmpeg', '-y', '-v', 'error', '-i', filename,
+        '-map', '0:a:0', '-vn', '-c:a', 'copy', output],
+        stage='extract_audio', media=filename)
+    if returncode != 0:
+        logging.warning((filename, 'audio extraction failed with', returncode))
+        try:
+            os.remove(output)
+        except OSError:
+            pass
+        return None
+    logging.info((
+        'extracted the audio of', filename, 'in',
+        f'{time.perf_counter() - start:.2f}s'))
+    return output
+
+def ffmpeg(cmd, wait = True, stage: str = None, media: str = None):
     logging.info(('calling', cmd, 'in terminal:'))
-    process = subprocess.Popen(cmd)
     if wait:
+        return ffmpeg_progress(cmd, stage, media).returncode
+    process = subprocess.Popen(cmd)
+    return process.returncode
+
+def with_progress(cmd: list, pipe: str = 'pipe:1') -> list:
+    '''cmd reporting its progress as key=value lines to pipe.'''
+    return cmd[:1] + ['-progress', pipe, '-nostats'] + cmd[1:]
+
+def ffmpeg_progress(cmd: list, stage: str = None, media: str = None) -> FFmpegMetrics:
+    '''runs cmd with -progress on its stdout and records what it reported.'''
+    metrics = FFmpegMetrics(cmd, stage, media)
+    start = time.perf_counter()
+    process = subprocess.Popen(
+        with_progress(cmd), stdout=subprocess.PIPE, text=True)
+    for line in process.stdout:
+        metrics.update(line)
+    metrics.returncode = process.wait()
+    metrics.elapsed = time.perf_counter() - start
+    record_ffmpeg(metrics)
+    return metrics
+
+class FFmpegResult():
+
+    def __init__(
+            self, cmd: list, name: str, returncode: int, elapsed: float,
+            metrics: list = None):
+        self.cmd = cmd
+        self.name = name
+        self.returncode = returncode
+        self.elapsed = elapsed
+        self.metrics = metrics or []
+
+class FFmpegExecutor():
+    '''
+    runs ffmpeg commands on a bounded pool so at most max_workers ffmpeg
+    processes are alive at once; collects exit codes and per-command timings.
+    '''
+
+    def __init__(self, max_workers: int = FFMPEG_WORKERS):
+        self.max_workers = max_workers
+        self.pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='ffmpeg')
+
+    def _run(self, cmd: list, name: str, stage: str, media: str) -> FFmpegResult:
+        start = time.perf_counter()
+        logging.info(('calling', cmd, 'in terminal:'))
+        metrics = ffmpeg_progress(cmd, stage, media)
+        return FFmpegResult(
+            cmd, name, metrics.returncode, time.perf_counter() - start,
+            [metrics])
+
+    def submit(
+            self, cmd: list, name: str = None, stage: str = None,
+            media: str = None) -> Future:
+        '''
+        runs one ffmpeg cmd; its progress is recorded under stage and media in
+        utils.metrics.
+        '''
+        if name is None:
+            name = cmd[-1]
+        return self.pool.submit(self._run, cmd, name, stage, media)
+
+    def run(
+            self, cmds: list, names: list = None, stage: str = None,
+            media: str = None, on_done=None) -> list:
+        '''
+        runs cmds and waits for all of them; results are in cmds order.
+        on_done(result) is called from this thread as each one exits, so every
+        call has returned by the time run does.
+        '''
+        names = names or [None] * len(cmds)
+        futures = [
+            self.submit(cmd, name, stage, media) for cmd, name in zip(cmds, names)]
+        if on_done is not None:
+            for future in as_completed(futures):
+                on_done(future.result())
+        results = [x.result() for x in futures]
+        for result in results:
+            out_time = sum(x.out_time for x in result.metrics)
+            logging.info((
+                result.name, 'finished with', result.returncode,
+                'in', f'{result.elapsed:.2f}s',
+                f'({out_time / result.elapsed:.1f}x realtime)'
+                if result.elapsed else ''))
+        failed = [x.name for x in results if x.returncode != 0]
+        if len(failed) > 0:
+            logging.error(('ffmpeg failed on', failed))
+        return results
+
+_ffmpeg_executors = {}
+
+def get_ffmpeg_executor(max_workers: int = None) -> FFmpegExecutor:
+    '''the shared executor for max_workers (FFMPEG_WORKERS by default).'''
+    max_workers = max_workers or FFMPEG_WORKERS
+    if max_workers not in _ffmpeg_executors:
+        _ffmpeg_executors[max_workers] = FFmpegExecutor(max_workers)
+    return _ffmpeg_executors[max_workers]
+
+def pcm_windows(filename: str, window_sec: float, sample_rate: int = 16000):
+    '''
+    decodes filename once through an ffmpeg pipe into mono s16le PCM and
+    yields (start_sec, samples) for consecutive windows of window_sec seconds.
+    only the window being yielded is held in memory.
+    '''
+    cmd = [
+        'ffmpeg', '-v', 'error', '-nostdin',
+        '-i', filename,
+        '-vn', '-ac', '1', '-ar', str(sample_rate),
+        '-f', 's16le', 'pipe:1']
+    logging.info(('streaming', cmd))
+    window_bytes = int(window_sec * sample_rate) * 2
+    decoded = 0
+    metrics = FFmpegMetrics(cmd, 'decode', filename)
+    start = time.perf_counter()
+    # stdout carries the PCM, so progress (and errors) come through stderr.
+    process = subprocess.Popen(
+        with_progress(cmd, 'pipe:2'), stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE, text=False)
+    progress = threading.Thread(
+        target=_read_progress, args=(process.stderr, metrics), daemon=True)
+    progress.start()
+    try:
+        while True:
+            buffer = process.stdout.read(window_bytes)
+            if not buffer:
+                break
+            samples = np.frombuffer(buffer[:len(buffer) // 2 * 2], dtype=np.int16)
+            yield decoded / sample_rate, samples
+            decoded += len(samples)
+    finally:
+        process.stdout.close()
+        if process.poll() is None:
+            process.kill()
         process.wait()
-    return 1
+        progress.join()
+        metrics.returncode = 0 if process.returncode == -9 else process.returncode
+        metrics.elapsed = time.perf_counter() - start
+        record_ffmpeg(metrics)
+    if process.returncode not in (0, -9):
+        logging.warning((filename, 'ffmpeg pcm stream exited with', process.returncode))
 
-def get_segment_process_length_array(filename: str, thres: int = 0):
+def pcm_window(
+        filename: str, offset: float, duration: float,
+        sample_rate: int = 16000) -> bytes:
+    '''mono s16le PCM of duration seconds of filename from offset.'''
+    return subprocess.run([
+        'ffmpeg', '-v', 'error', '-nostdin', '-ss', str(offset),
+        '-t', str(duration), '-i', filename,
+        '-vn', '-ac', '1', '-ar', str(sample_rate), '-f', 's16le', 'pipe:1'],
+        stdout=subprocess.PIPE, check=True).stdout
+
+def wav_window(
+        filename: str, offset: float, duration: float,
+        sample_rate: int = 16000) -> bytes:
+    '''pcm_window wrapped into an in-memory wav file.'''
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as f:
+        f.setnchannels(1)
+        f.setsampwidth(2)
+        f.setframerate(sample_rate)
+        f.writeframes(pcm_window(filename, offset, duration, sample_rate))
+    return buffer.getvalue()
+
+def _read_progress(stream, metrics: FFmpegMetrics) -> None:
+    for line in stream:
+        line = line.decode('utf-8', 'replace')
+        if '=' in line:
+            metrics.update(line)
+        elif line.strip():
+            logging.warning(line.strip())
+
+def get_segment_process_length_array(
+        filename: str, thres: int = 0, workers: int = 1, fallback: int = 800):
+    '''
+    thres: max seconds per chunk; 0 for one chunk, SEGMENT_THRES_AUTO to size
+    chunks from the available memory (fallback when it cannot be read), cut
+    down so every one of workers gets a chunk.
+    '''
     if not thres:
         return [[None, None]]
-    try:
-        file_length = timestamp2sec(get_length(filename))
-    except Exception:
-        file_length = 0
-    if file_length == 0:
-        logging.warning(f'ffprobe on {filename} length failed.\
-            now extracting the audio and probing the resulting audio file.')
-        file_length = timestamp2sec(get_length_using_copied_audio(filename))
-        # something is wrong; happens with DDrecorder's raw streams.
-        # i just copy the audio segment and probe that one instead.
+    file_length = media_info(filename).duration
+    if thres == SEGMENT_THRES_AUTO:
+        thres = auto_segment_length(fallback, workers)
+        if workers > 1:
+            thres = min(thres, max(
+                SEGMENT_THRES_MIN, math.ceil(file_length / workers)))
     logging.info((filename, 'total seconds', sec2timestamp(file_length)))
     if thres > file_length:
         return [[None, None]]
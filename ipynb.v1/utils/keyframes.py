@@ -0,0 +1,109 @@
+import os
+import json
+import bisect
+import hashlib
+import logging
+import subprocess
+
+from utils.ffmpeg import media_info
+from utils.paths import CACHE_DIR
+
+
+KEYFRAME_CACHE_DIR = os.path.join(CACHE_DIR, 'keyframes')
+# 视频切片模式：copy 直接流复制（从前一个关键帧开始），snap 把起点对齐到最近的关键帧
+CUT_MODES = ('copy', 'snap')
+# 起点离关键帧不到这么多秒时直接流复制
+KEYFRAME_TOLERANCE = 0.05
+
+
+class KeyframeIndex():
+    '''keyframe times (seconds, sorted) and codec of a media's first video stream.'''
+
+    def __init__(self, keyframes: list, codec: str = None):
+        self.keyframes = keyframes
+        self.codec = codec
+
+    def before(self, sec: float) -> float:
+        '''the last keyframe at or before sec.'''
+        i = bisect.bisect_right(self.keyframes, sec + KEYFRAME_TOLERANCE)
+        return self.keyframes[i - 1] if i > 0 else 0.
+
+    def after(self, sec: float):
+        '''the first keyframe at or after sec; None past the last one.'''
+        i = bisect.bisect_left(self.keyframes, sec - KEYFRAME_TOLERANCE)
+        return self.keyframes[i] if i < len(self.keyframes) else None
+
+    def nearest(self, sec: float) -> float:
+        after = self.after(sec)
+        before = self.before(sec)
+        if after is None or sec - before <= after - sec:
+            return before
+        return after
+
+
+def _cache_path(media: str, cache_dir: str) -> str:
+    stat = os.stat(media)
+    key = f'{os.path.abspath(media)}:{stat.st_size}:{stat.st_mtime_ns}'
+    return os.path.join(
+        cache_dir, hashlib.sha1(key.encode()).hexdigest() + '.json')
+
+
+def probe_keyframes(media: str) -> KeyframeIndex:
+    '''scans the packet flags of the first video stream with ffprobe.'''
+    codec = media_info(media).video_codec
+    if codec is None:
+        return KeyframeIndex([], None)
+    process = subprocess.Popen([
+        'ffprobe', '-v', 'error', '-select_streams', 'v:0',
+        '-show_entries', 'packet=pts_time,flags', '-of', 'csv=p=0', media],
+        stdout=subprocess.PIPE, text=True)
+    keyframes = []
+    for line in process.stdout:
+        pts_time, _, flags = line.strip().partition(',')
+        if 'K' in flags:
+            try:
+                keyframes.append(float(pts_time))
+            except ValueError:
+                continue
+    process.wait()
+    return KeyframeIndex(sorted(keyframes), codec)
+
+
+def get_keyframe_index(
+        media: str, cache_dir: str = KEYFRAME_CACHE_DIR) -> KeyframeIndex:
+    '''
+    the keyframe index of media, probed once and cached in cache_dir per
+    (path, size, mtime).
+    '''
+    path = _cache_path(media, cache_dir)
+    try:
+        with open(path, encoding='utf-8') as f:
+            saved = json.load(f)
+        return KeyframeIndex(saved['keyframes'], saved['codec'])
+    except FileNotFoundError:
+        pass
+    except (OSError, ValueError, KeyError):
+        logging.warning(['keyframe index', path, 'is corrupted; probing again.'])
+    index = probe_keyframes(media)
+    logging.info([media, 'has', len(index.keyframes), index.codec, 'keyframes'])
+    os.makedirs(cache_dir, exist_ok=True)
+    temp_path = f'{path}.{os.getpid()}.tmp'
+    with open(temp_path, 'w', encoding='utf-8') as f:
+        json.dump({'keyframes': index.keyframes, 'codec': index.codec}, f)
+    os.replace(temp_path, path)
+    return index
+
+
+def cut_cmd(
+        media: str, index: KeyframeIndex, start: float, stop: float,
+        output: str, mode: str = 'snap') -> list:
+    '''
+    the ffmpeg command that stream copies start:stop seconds of media into
+    output. snap moves start onto the nearest keyframe, so the clip neither
+    opens on frames it cannot decode nor grows by up to a GOP.
+    '''
+    if mode == 'snap' and index.keyframes:
+        start = index.nearest(start)
+    return [
+        'ffmpeg', '-y', '-ss', str(start), '-i', media, '-t', str(stop - start),
+        '-map', '0', '-c', 'copy', '-avoid_negative_ts', 'make_zero', output]
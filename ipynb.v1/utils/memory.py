@@ -0,0 +1,165 @@
+import os
+import logging
+try:
+    import resource
+except ImportError:
+    # windows
+    resource = None
+
+from network.extractor import load_config, save_config
+from utils.paths import CACHE_DIR
+
+
+MEMORY_PROFILE_PATH = os.path.join(CACHE_DIR, 'memory.yaml')
+# max_segment_length 设为此值时按可用内存自动选择分段长度
+SEGMENT_THRES_AUTO = -1
+# 自动分段长度下限（秒）
+SEGMENT_THRES_MIN = 120
+# 每秒音频的峰值内存（字节）初始估计：1G 内存约 10 分钟，16G 约 5 小时
+SEGMENT_BYTES_PER_SEC = 900 * 1024
+# 每个额外分段进程加载模型的内存（字节）
+SEGMENT_BASE_BYTES = 500 * 1024 * 1024
+# 只规划可用内存的这个比例
+MEMORY_SAFETY = 0.7
+# PSI some avg10 超过此百分比，或可用内存低于总内存的此比例时视为内存紧张
+MEMORY_PRESSURE_AVG10 = 10.
+MEMORY_PRESSURE_FREE = 0.1
+
+
+def _read_int(path: str):
+    try:
+        with open(path) as f:
+            value = f.read().strip()
+        return None if value == 'max' else int(value)
+    except (OSError, ValueError):
+        return None
+
+
+def _meminfo() -> dict:
+    r = {}
+    try:
+        with open('/proc/meminfo') as f:
+            for line in f:
+                key, value = line.split(':', 1)
+                r[key] = int(value.split()[0]) * 1024
+    except (OSError, ValueError):
+        pass
+    return r
+
+
+def total_memory():
+    '''physical memory or the cgroup (docker) limit, whichever is smaller.'''
+    limits = [
+        _meminfo().get('MemTotal'),
+        _read_int('/sys/fs/cgroup/memory.max'),
+        _read_int('/sys/fs/cgroup/memory/memory.limit_in_bytes'),
+    ]
+    limits = [x for x in limits if x]
+    return min(limits) if limits else None
+
+
+def available_memory():
+    '''bytes that can still be allocated, honoring cgroup limits; None if unknown.'''
+    available = [_meminfo().get('MemAvailable')]
+    for limit, usage in (
+            ('/sys/fs/cgroup/memory.max', '/sys/fs/cgroup/memory.current'),
+            ('/sys/fs/cgroup/memory/memory.limit_in_bytes',
+             '/sys/fs/cgroup/memory/memory.usage_in_bytes')):
+        limit, usage = _read_int(limit), _read_int(usage)
+        if limit and usage is not None and limit < 1 << 60:
+            available.append(max(0, limit - usage))
+    available = [x for x in available if x is not None]
+    return min(available) if available else None
+
+
+def memory_pressure() -> bool:
+    try:
+        with open('/proc/pressure/memory') as f:
+            some = f.readline().split()
+        avg10 = float(dict(x.split('=') for x in some[1:])['avg10'])
+        if avg10 > MEMORY_PRESSURE_AVG10:
+            return True
+    except (OSError, ValueError, KeyError):
+        pass
+    available, total = available_memory(), total_memory()
+    if available is None or not total:
+        return False
+    return available / total < MEMORY_PRESSURE_FREE
+
+
+def current_rss() -> int:
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError):
+        return 0
+
+
+def peak_rss() -> int:
+    if resource is None:
+        return 0
+    # ru_maxrss is in KB on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+class MemoryProfile():
+    '''
+    peak bytes per audio second the segmenter needed, measured from chunks
+    that raised the process' peak RSS and saved across runs.
+    '''
+
+    def __init__(
+        self,
+        bytes_per_sec: float = SEGMENT_BYTES_PER_SEC,
+        path: str = MEMORY_PROFILE_PATH,
+    ):
+        self.bytes_per_sec = bytes_per_sec
+        self.path = path
+
+    @classmethod
+    def load(cls, path: str = MEMORY_PROFILE_PATH):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        saved = load_config(path, {}) or {}
+        return cls(saved.get('bytes_per_sec', SEGMENT_BYTES_PER_SEC), path)
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        save_config(self.path, {'bytes_per_sec': float(self.bytes_per_sec)})
+
+    def observe(
+            self, audio_sec: float, rss_before: int,
+            peak_before: int, peak_after: int) -> None:
+        if not audio_sec or peak_after <= peak_before or peak_after <= rss_before:
+            return
+        measured = (peak_after - rss_before) / audio_sec
+        # never plan below what was just measured; relax slowly otherwise.
+        self.bytes_per_sec = max(measured, (self.bytes_per_sec + measured) / 2)
+        logging.debug(['segmenter memory profile', measured, 'bytes per second'])
+
+    def segment_length(self, available: int, workers: int = 1) -> int:
+        budget = (available * MEMORY_SAFETY -
+                  (workers - 1) * SEGMENT_BASE_BYTES) / workers
+        return max(SEGMENT_THRES_MIN, int(budget / self.bytes_per_sec))
+
+
+_memory_profile = None
+
+
+def get_memory_profile() -> MemoryProfile:
+    global _memory_profile
+    if _memory_profile is None:
+        _memory_profile = MemoryProfile.load()
+    return _memory_profile
+
+
+def auto_segment_length(fallback: int, workers: int = 1) -> int:
+    '''segment length in seconds that fits the memory available right now.'''
+    available = available_memory()
+    if available is None:
+        logging.warning(['available memory unknown; segmenting by', fallback])
+        return fallback
+    length = get_memory_profile().segment_length(available, workers)
+    logging.info([
+        'available memory', available // (1024 * 1024), 'MB; segmenting by',
+        length, 'seconds'])
+    return length
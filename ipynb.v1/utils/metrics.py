@@ -0,0 +1,114 @@
+import time
+import logging
+import threading
+from contextlib import contextmanager
+
+
+class FFmpegMetrics():
+    '''what one ffmpeg call reported through -progress, plus its wall time.'''
+
+    def __init__(self, cmd: list, stage: str = None, media: str = None):
+        self.cmd = cmd
+        self.stage = stage
+        self.media = media
+        self.returncode = None
+        self.elapsed = 0.
+        # seconds of output written, ffmpeg's own speed, bytes written
+        self.out_time = 0.
+        self.speed = 0.
+        self.total_size = 0
+        self.progress = {}
+
+    def update(self, line: str) -> None:
+        '''feeds one key=value line of ffmpeg -progress output.'''
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return
+        self.progress[key] = value
+        try:
+            if key in ('out_time_us', 'out_time_ms'):
+                # both are microseconds, out_time_ms is misnamed by ffmpeg
+                self.out_time = max(self.out_time, int(value) / 1e6)
+            elif key == 'total_size':
+                self.total_size = int(value)
+            elif key == 'speed' and value.endswith('x'):
+                self.speed = float(value[:-1])
+        except ValueError:
+            pass
+
+    @property
+    def realtime(self) -> float:
+        '''seconds of media written per wall second.'''
+        return self.out_time / self.elapsed if self.elapsed else 0.
+
+
+class StageMetrics():
+
+    def __init__(self):
+        self.calls = 0
+        self.wall = 0.
+        self.media_sec = 0.
+        self.bytes = 0
+        self.failures = 0
+
+    @property
+    def realtime(self) -> float:
+        return self.media_sec / self.wall if self.wall else 0.
+
+
+_lock = threading.Lock()
+# {media: {stage: StageMetrics}}
+_stages = {}
+
+
+def _stage_metrics(media: str, stage: str) -> StageMetrics:
+    return _stages.setdefault(media, {}).setdefault(stage, StageMetrics())
+
+
+def record_ffmpeg(metrics: FFmpegMetrics) -> None:
+    with _lock:
+        stage = _stage_metrics(metrics.media, metrics.stage or 'ffmpeg')
+        stage.calls += 1
+        stage.wall += metrics.elapsed
+        stage.media_sec += metrics.out_time
+        stage.bytes += metrics.total_size
+        stage.failures += metrics.returncode != 0
+    logging.debug([
+        metrics.stage, metrics.cmd[-1], 'wrote', f'{metrics.out_time:.1f}s',
+        f'{metrics.total_size} bytes in {metrics.elapsed:.2f}s',
+        f'({metrics.realtime:.1f}x realtime, ffmpeg speed {metrics.speed}x)'])
+
+
+@contextmanager
+def stage(name: str, media: str = None, media_sec: float = 0.):
+    '''times a pipeline stage over media_sec seconds of media.'''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        with _lock:
+            metrics = _stage_metrics(media, name)
+            metrics.calls += 1
+            metrics.wall += elapsed
+            metrics.media_sec += media_sec
+        logging.info([
+            name, media, f'took {elapsed:.2f}s',
+            f'({media_sec / elapsed:.1f}x realtime)' if media_sec and elapsed else ''])
+
+
+def media_metrics(media: str) -> dict:
+    with _lock:
+        return dict(_stages.get(media, {}))
+
+
+def log_media_metrics(media: str) -> None:
+    '''logs every stage aggregated for media, then forgets them.'''
+    with _lock:
+        stages = _stages.pop(media, {})
+    for name, metrics in stages.items():
+        logging.info([
+            media, name, metrics.calls, 'calls', f'{metrics.wall:.2f}s wall',
+            f'{metrics.media_sec:.1f}s media',
+            f'{metrics.realtime:.1f}x realtime', metrics.bytes, 'bytes',
+            metrics.failures, 'failed'])
@@ -0,0 +1,8 @@
+import os
+
+# 缓存（分段结果、关键帧、识曲结果、指纹、封面、内存画像）的根目录；
+# 可用环境变量 INASEG_CACHE_DIR 指定，默认 $XDG_CACHE_HOME/inaseg 或 ~/.cache/inaseg
+CACHE_DIR = os.environ.get('INASEG_CACHE_DIR') or os.path.join(
+    os.environ.get('XDG_CACHE_HOME') or os.path.join(
+        os.path.expanduser('~'), '.cache'),
+    'inaseg')